@@ -36,6 +36,7 @@ from . import eth_protocol
 from . import utils
 from .accounts import AccountsService, Account
 from .console_service import Console
+from .db_compression import train_dictionary
 from .db_service import DBService
 from .eth_service import ChainService
 from .jsonrpc import JSONRPCServer, IPCRPCServer
@@ -435,14 +436,18 @@ def export_blocks(ctx, from_, to, file):
         sys.exit(1)
 
     log.info('Starting export')
-    for n in range(from_, to + 1):
-        log.debug('Exporting block {}'.format(n))
-        if (n - from_) % 50000 == 0:
+    batch_size = 1024
+    next_log = from_
+    for n in range(from_, to + 1, batch_size):
+        if n >= next_log:
             log.info('Exporting block {} to {}'.format(n, min(n + 50000, to)))
-        block_hash = app.services.chain.chain.get_blockhash_by_number(n)
+            next_log += 50000
+        log.debug('Exporting blocks {} to {}'.format(n, min(n + batch_size - 1, to)))
+        numbers = range(n, min(n + batch_size, to + 1))
+        block_hashes = app.services.chain.get_blockhashes_by_number(numbers)
         # bypass slow block decoding by directly accessing db
-        block_rlp = app.services.db.get(block_hash)
-        file.write(block_rlp)
+        for block_rlp in app.services.chain.get_blocks_rlp(block_hashes):
+            file.write(block_rlp)
     log.info('Export complete')
 
 
@@ -510,12 +515,95 @@ def import_blocks(ctx, file):
         app.services.chain.add_block(block, None)  # None for proto
 
     # let block processing finish
-    while not app.services.chain.block_queue.empty():
+    while not app.services.chain.block_queue.empty() or app.services.chain.add_blocks_lock:
         gevent.sleep()
     app.stop()
     log.info('import finished', head_number=app.services.chain.chain.head.number)
 
 
+@app.command('backfill_receipts')
+@click.option('--from', 'from_', type=int, default=1,
+              help='Number of the first block (default: 1)')
+@click.pass_context
+def backfill_receipts(ctx, from_):
+    """Store the receipts of the canonical chain in the database.
+
+    Receipts are stored for blocks imported from now on. This command executes the blocks
+    of an existing database once to store theirs as well, so that receipt and log queries
+    do not have to. The state of the parent of the first block must be available, i.e. the
+    database must not be pruned.
+    """
+    app = EthApp(ctx.obj['config'])
+    DBService.register_with_app(app)
+    AccountsService.register_with_app(app)
+    ChainService.register_with_app(app)
+    if from_ < 1:
+        log.fatal('the first block must not be the genesis')
+        sys.exit(1)
+    stored = app.services.chain.backfill_receipts(from_)
+    log.info('backfill finished', blocks=stored)
+
+
+@app.command('train_compression_dict')
+@click.option('-n', '--samples', type=int, default=20000,
+              help='Number of values to sample (default: 20000)')
+@click.argument('file', type=click.File('wb'))
+@click.pass_context
+def train_compression_dict(ctx, samples, file):
+    """Train a compression dictionary on the trie nodes and blocks in the database.
+
+    The dictionary is written to FILE, use it by setting db.compression_dict to its path. It
+    must stay configured as long as values compressed with it are in the database.
+    """
+    app = EthApp(ctx.obj['config'])
+    DBService.register_with_app(app)
+    db = app.services.db
+
+    values = []
+    for key in db.iter_keys():
+        if len(key) == 32:  # hash keys, i.e. RLP encoded trie nodes and blocks
+            values.append(db.get(key))
+            if len(values) >= samples:
+                break
+    zdict = train_dictionary(values)
+    file.write(zdict)
+    log.info('dictionary written', samples=len(values), size=len(zdict))
+
+
+@app.command('bench_db')
+@click.option('-n', '--keys', type=int, default=100000,
+              help='Number of keys written (default: 100000)')
+@click.option('-r', '--reads', type=int, default=100000,
+              help='Number of random reads and misses (default: 100000)')
+@click.option('--real', is_flag=True,
+              help='Use a sample of the keys and values in the database of the data dir')
+@click.option('-i', '--implementation', multiple=True,
+              help='Backend to benchmark, may be repeated (default: all available)')
+@click.option('--block-queue', is_flag=True,
+              help='Also benchmark the lookups of queued block hashes')
+@click.pass_context
+def bench_db(ctx, keys, reads, real, implementation, block_queue):
+    """Benchmark the database backends.
+
+    Each backend gets a fresh database in a temporary directory, using the db options of
+    the configuration.
+    """
+    from pyethapp.bench import db as bench
+
+    config = ctx.obj['config']
+    if real:
+        app = EthApp(config)
+        DBService.register_with_app(app)
+        items = bench.sample_items(app.services.db, keys)
+        app.services.db.stop()
+    else:
+        items = bench.synthetic_items(keys)
+    bench.run(items, reads, implementation, config['db'])
+    if block_queue:
+        from pyethapp.bench import block_queue as bench_block_queue
+        bench_block_queue.run(max(1, reads // 256))
+
+
 @app.group()
 @click.pass_context
 def account(ctx):
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+"""
+Microbenchmark of the queued block lookups of :meth:`ChainService.knows_block`.
+
+The block queue is full and every peer announcement carries 256 hashes, of which none are
+queued, the worst case for a lookup. Run it as
+
+    pyethapp bench_db --block-queue [-r READS]
+
+where READS, rounded to whole announcements, is the number of lookups.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import object
+from builtins import range
+import os
+import time
+
+from pyethapp.eth_service import BlockQueue
+
+
+class _Header(object):
+
+    def __init__(self, block_hash):
+        self.hash = block_hash
+
+
+class _QueuedBlock(object):
+
+    def __init__(self, block_hash):
+        self.header = _Header(block_hash)
+
+
+def bench_lookups(num_announcements, queue_size=1024, announcement_size=256):
+    "returns the lookups per second and the milliseconds spent per announcement"
+    queue = BlockQueue(maxsize=queue_size)
+    for _ in range(queue_size):
+        queue.put((_QueuedBlock(os.urandom(32)), None))
+    announcements = [[os.urandom(32) for _ in range(announcement_size)]
+                     for _ in range(num_announcements)]
+    st = time.time()
+    for hashes in announcements:
+        for block_hash in hashes:
+            assert block_hash not in queue
+    elapsed = time.time() - st
+    num = num_announcements * announcement_size
+    return (num / elapsed if elapsed else float('inf'),
+            elapsed * 1000 / num_announcements)
+
+
+def run(num_announcements, out=print):
+    "benchmarks the lookups and prints the results"
+    rate, per_announcement = bench_lookups(num_announcements)
+    out('%-10s%14s%14s' % ('queue', 'lookup/s', 'announce ms'))
+    out('%-10s%14.1f%14.3f' % ('BlockQueue', rate, per_announcement))
+    return rate, per_announcement
@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+"""
+Microbenchmarks of the database backends registered in :data:`pyethapp.db_service.dbs`.
+
+Measures sequential puts, commit latency, how long the gevent hub stalls during the commit,
+random gets, batched gets, lookups of missing keys and the memory growth of the process,
+either with synthetic values of typical trie node sizes or with a sample of the keys and
+values of an existing database. Run it as
+
+    pyethapp bench_db [--real] [-n KEYS] [-r READS] [-i IMPLEMENTATION ...]
+
+Compare the stalls with and without `db.io_threads` to see what the io threadpool buys.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+from collections import OrderedDict
+import binascii
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import gevent
+from devp2p.app import BaseApp
+from ethereum.utils import sha3
+
+from pyethapp.db_service import dbs, get_many
+
+
+def synthetic_items(num_keys, seed=0):
+    "returns `num_keys` (hash, value) pairs with trie node sized values"
+    rng = random.Random(seed)
+    items = []
+    for i in range(num_keys):
+        size = rng.randint(70, 532)
+        value = binascii.unhexlify('%0*x' % (2 * size, rng.getrandbits(8 * size)))
+        items.append((sha3(value), value))
+    return items
+
+
+def sample_items(db, num_keys, scan_factor=20, seed=0):
+    """Returns a random sample of `num_keys` items of `db`.
+
+    Only the first `scan_factor * num_keys` keys are considered, to keep the time spent on
+    large databases bounded.
+    """
+    rng = random.Random(seed)
+    sample = []
+    for i, key in enumerate(db.iter_keys()):
+        if i >= scan_factor * num_keys:
+            break
+        if len(sample) < num_keys:
+            sample.append(key)
+        else:
+            j = rng.randint(0, i)
+            if j < num_keys:
+                sample[j] = key
+    return [(key, db.get(key)) for key in sample]
+
+
+def rss():
+    "returns the resident set size of the process in bytes"
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rate(num, elapsed):
+    return num / elapsed if elapsed else float('inf')
+
+
+def _probe(latencies, interval=0.001):
+    "records how late a greenlet waking up every `interval` seconds gets scheduled"
+    while True:
+        st = time.time()
+        gevent.sleep(interval)
+        latencies.append(time.time() - st - interval)
+
+
+def bench_backend(implementation, items, num_reads, dbconfig=None, seed=0):
+    "runs all measurements for one backend, returns them in an ordered dict"
+    rng = random.Random(seed)
+    results = OrderedDict()
+    data_dir = tempfile.mkdtemp(prefix='pyethapp-bench-')
+    rss_before = rss()
+    try:
+        app = BaseApp(dict(data_dir=data_dir, db=dict(dbconfig or {})))
+        db = dbs[implementation](app)
+
+        st = time.time()
+        for key, value in items:
+            db.put(key, value)
+        results['put/s'] = _rate(len(items), time.time() - st)
+
+        latencies = []
+        prober = gevent.spawn(_probe, latencies)
+        gevent.sleep(0.01)
+        st = time.time()
+        db.commit()
+        results['commit ms'] = (time.time() - st) * 1000
+        gevent.sleep(0.002)  # let the probe record the stall
+        prober.kill()
+        results['stall ms'] = max(latencies or [0]) * 1000
+
+        keys = [rng.choice(items)[0] for _ in range(num_reads)]
+        st = time.time()
+        for key in keys:
+            db.get(key)
+        results['get/s'] = _rate(num_reads, time.time() - st)
+
+        st = time.time()
+        for i in range(0, num_reads, 128):
+            get_many(db, keys[i:i + 128])
+        results['get_many/s'] = _rate(num_reads, time.time() - st)
+
+        missing = [sha3(os.urandom(8)) for _ in range(num_reads)]
+        st = time.time()
+        for key in missing:
+            assert key not in db
+        results['miss/s'] = _rate(num_reads, time.time() - st)
+
+        results['rss MB'] = (rss() - rss_before) / 1024 ** 2
+        db.stop()
+    finally:
+        shutil.rmtree(data_dir)
+    return results
+
+
+def run(items, num_reads, implementations=None, dbconfig=None, out=print):
+    "benchmarks the given backends, all registered ones by default, and prints a table"
+    implementations = implementations or sorted(dbs)
+    rows = [(impl, bench_backend(impl, items, num_reads, dbconfig)) for impl in implementations]
+    columns = list(rows[0][1])
+    out('%-10s' % 'backend' + ''.join('%14s' % c for c in columns))
+    for impl, results in rows:
+        out('%-10s' % impl + ''.join('%14.1f' % results[c] for c in columns))
+    return rows
@@ -0,0 +1,90 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from builtins import object
+from builtins import range
+import hashlib
+import math
+import os
+import struct
+
+from ethereum.utils import to_string
+
+
+class BloomFilter(object):
+
+    """
+    Bloom filter over database keys, answers "definitely absent" without a disk lookup.
+
+    There are no false negatives as long as every stored key has been added. Deleted keys
+    can not be removed and stay "maybe present".
+
+    capacity    number of keys the filter is dimensioned for
+    error_rate  false positive rate at capacity
+    """
+
+    header = struct.Struct('>4sQIQ')
+    magic = b'PBF1'
+
+    def __init__(self, capacity, error_rate=0.01, num_bits=None, num_hashes=None):
+        if num_bits is None:
+            num_bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+            num_bits = max(8, num_bits + (-num_bits % 8))
+        if num_hashes is None:
+            num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(num_bits // 8)
+        self.count = 0
+        self.queries = 0
+        self.negatives = 0
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack('>QQ', hashlib.md5(to_string(key)).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        self.queries += 1
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                self.negatives += 1
+                return False
+        return True
+
+    def stats(self):
+        return dict(num_bits=self.num_bits, num_hashes=self.num_hashes, count=self.count,
+                    queries=self.queries, negatives=self.negatives)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        "returns the filter stored at `path` or `None` if there is no valid snapshot"
+        try:
+            with open(path, 'rb') as f:
+                magic, num_bits, num_hashes, count = cls.header.unpack(f.read(cls.header.size))
+                bits = bytearray(f.read())
+        except (IOError, OSError, struct.error):
+            return None
+        if magic != cls.magic or len(bits) != num_bits // 8:
+            return None
+        bf = cls(None, num_bits=num_bits, num_hashes=num_hashes)
+        bf.bits = bits
+        bf.count = count
+        return bf
+
+    def __repr__(self):
+        return '<BloomFilter bits=%d hashes=%d count=%d>' % (
+            self.num_bits, self.num_hashes, self.count)
@@ -0,0 +1,73 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+from collections import OrderedDict
+
+
+class ReadCache(object):
+
+    """
+    LRU cache for values read from a database, bounded by the total size of the
+    cached values in bytes.
+
+    The cache only ever holds data that is known to be on disk. Pending writes
+    are kept by the database backends themselves, entries for keys that are
+    written or deleted have to be invalidated by the caller.
+
+    max_bytes  maximum accumulated length of all cached values, 0 disables the cache
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        "returns the cached value or None, marks key as most recently used"
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.invalidate(key)
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(entries=len(self.entries), size=self.size, max_bytes=self.max_bytes,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_rate=float(self.hits) / lookups if lookups else 0.)
+
+    def __repr__(self):
+        return '<ReadCache entries=%d size=%d/%d>' % (len(self.entries), self.size,
+                                                      self.max_bytes)
@@ -0,0 +1,151 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from builtins import object
+from builtins import range
+from collections import Counter
+import struct
+import time
+import zlib
+
+from ethereum.slogging import get_logger
+
+log = get_logger('db')
+
+MARKER = b'\xff'
+ZLIB = b'\x01'
+ZLIB_DICT = b'\x02'
+
+
+class Compressor(object):
+
+    """
+    Per-record zlib compression of database values.
+
+    Compressed values start with `MARKER` (0xff) and a byte naming the method. RLP never
+    starts with 0xff for values of realistic size, so values stored before compression was
+    enabled, or stored raw because they did not shrink, are returned unchanged. Raw values
+    which happen to start with 0xff are always stored compressed to keep this unambiguous.
+
+    The zlib stream header tells compressed values apart from raw ones which merely start
+    with the marker, e.g. block hashes stored before compression was enabled. A value with a
+    valid header which can not be decompressed raises `ValueError` naming the cause, e.g. a
+    missing or different dictionary, or a truncated stream.
+
+    level      zlib level 1-9, 0 stores new values raw (but still reads compressed ones)
+    zdict      preset dictionary, see :func:`train_dictionary` (python 3 only)
+    min_size   values shorter than this are stored raw
+    """
+
+    def __init__(self, level=6, zdict=None, min_size=64):
+        if zdict and not _supports_zdict():
+            log.warn('zlib without preset dictionary support, ignoring compression_dict')
+            zdict = None
+        self.level = level
+        self.zdict = zdict
+        self.min_size = min_size
+        self.stored_bytes = 0
+        self.raw_bytes = 0
+        self.compress_time = 0.
+        self.decompress_time = 0.
+
+    def compress(self, value):
+        if not value.startswith(MARKER) and (not self.level or len(value) < self.min_size):
+            return value
+        st = time.time()
+        if self.zdict:
+            c = zlib.compressobj(self.level or 6, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                 self.zdict)
+            o = MARKER + ZLIB_DICT + c.compress(value) + c.flush()
+        else:
+            o = MARKER + ZLIB + zlib.compress(value, self.level or 6)
+        if len(o) >= len(value) and not value.startswith(MARKER):
+            o = value
+        self.compress_time += time.time() - st
+        self.raw_bytes += len(value)
+        self.stored_bytes += len(o)
+        return o
+
+    def decompress(self, value):
+        if value[:1] != MARKER:
+            return value
+        st = time.time()
+        method, data = value[1:2], value[2:]
+        if method == ZLIB and _is_zlib_stream(data, fdict=False):
+            try:
+                value = zlib.decompress(data)
+            except zlib.error as e:
+                raise ValueError('corrupt or truncated compressed value: %s' % e)
+        elif method == ZLIB_DICT and _is_zlib_stream(data, fdict=True):
+            value = self._decompress_with_dict(data)
+        self.decompress_time += time.time() - st
+        return value
+
+    def _decompress_with_dict(self, data):
+        if not self.zdict:
+            raise ValueError('value compressed with a dictionary, set db.compression_dict')
+        if data[2:6] != struct.pack('>I', zlib.adler32(self.zdict) & 0xffffffff):
+            raise ValueError('value compressed with a different dictionary than '
+                             'db.compression_dict')
+        d = zlib.decompressobj(15, self.zdict)
+        try:
+            value = d.decompress(data)
+        except zlib.error as e:
+            raise ValueError('corrupt compressed value: %s' % e)
+        if not d.eof:
+            raise ValueError('truncated compressed value')
+        return value
+
+    def stats(self):
+        return dict(level=self.level, dictionary=len(self.zdict or b''),
+                    raw_bytes=self.raw_bytes, stored_bytes=self.stored_bytes,
+                    ratio=self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.,
+                    compress_time=self.compress_time, decompress_time=self.decompress_time)
+
+    def __repr__(self):
+        return '<Compressor level=%d dictionary=%d>' % (self.level, len(self.zdict or b''))
+
+
+def _is_zlib_stream(data, fdict):
+    "if `data` starts with a zlib stream header, with a preset dictionary id if `fdict`"
+    if len(data) < (6 if fdict else 2):
+        return False
+    cmf, flg = ord(data[0:1]), ord(data[1:2])
+    return cmf & 0x0f == 8 and cmf >> 4 <= 7 and (cmf << 8 | flg) % 31 == 0 and \
+        bool(flg & 0x20) == fdict
+
+
+def _supports_zdict():
+    try:
+        zlib.compressobj(6, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, b'x')
+    except TypeError:
+        return False
+    return True
+
+
+def train_dictionary(samples, size=32 * 1024, ngram=8):
+    """Build a zlib preset dictionary from sample values, e.g. RLP encoded trie nodes.
+
+    Collects the most frequent `ngram` byte substrings, the most frequent ones last, as
+    zlib finds matches at the end of the dictionary with the shortest distances.
+    """
+    counts = Counter()
+    for sample in samples:
+        for i in range(0, len(sample) - ngram + 1):
+            counts[sample[i:i + ngram]] += 1
+    common = [s for s, c in counts.most_common(size // ngram) if c > 1]
+    return b''.join(reversed(common))
+
+
+def from_config(dbconfig):
+    """Returns the :class:`Compressor` configured by the `db.compression_*` options.
+
+    There is one even with compression disabled, to read values compressed earlier.
+    """
+    path = dbconfig.get('compression_dict')
+    zdict = None
+    if path:
+        with open(path, 'rb') as f:
+            zdict = f.read()
+    return Compressor(dbconfig.get('compression_level', 0), zdict,
+                      dbconfig.get('compression_min_size', 64))
@@ -0,0 +1,161 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+import mmap
+import os
+import struct
+
+from ethereum.slogging import get_logger
+
+log = get_logger('db')
+
+FROZEN = b'frozen:'  # prefix of the pointers left in the hot database, followed by a block hash
+
+
+class Freezer(object):
+
+    """
+    Append-only flat file store for the RLP of ancient canonical blocks, addressed by number.
+
+    The blocks are appended to segment files of `segment_blocks` blocks each. The index file
+    starts with the number of the first block, followed by one entry (offset in segment,
+    length) per block. It is memory mapped for lookups.
+
+    Index entries are kept in memory until :meth:`flush` has synced the segments, so that the
+    index on disk never points past durable data. After a crash :meth:`_recover` drops index
+    entries whose data is not (fully) in its segment, and cuts off what has not been indexed.
+    """
+
+    header = struct.Struct('>Q')
+    entry = struct.Struct('>QI')
+
+    def __init__(self, path, segment_blocks=100000):
+        self.path = path
+        self.segment_blocks = segment_blocks
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index_path = os.path.join(path, 'index')
+        self.index = open(self.index_path, 'a+b')
+        self.index_map = None
+        self.index_tail = []  # packed index data not written yet
+        self.first = None
+        self.count = 0
+        self.segments = dict()  # segment number: open file
+        self._recover()
+        self._map_index()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, 'blocks.%06d' % segment)
+
+    def _segment(self, segment):
+        if segment not in self.segments:
+            self.segments[segment] = open(self._segment_path(segment), 'a+b')
+        return self.segments[segment]
+
+    def _recover(self):
+        size = os.path.getsize(self.index_path)
+        if size < self.header.size:
+            self.index.truncate(0)
+            return
+        self.index.seek(0)
+        self.first, = self.header.unpack(self.index.read(self.header.size))
+        self.count = (size - self.header.size) // self.entry.size
+        end = None
+        while self.count:
+            self.index.seek(self.header.size + (self.count - 1) * self.entry.size)
+            offset, length = self.entry.unpack(self.index.read(self.entry.size))
+            segment_path = self._segment_path(self._segment_of(self.first + self.count - 1))
+            if os.path.exists(segment_path) and os.path.getsize(segment_path) >= offset + length:
+                end = offset + length
+                break
+            log.warn('dropping frozen block missing from its segment',
+                     number=self.first + self.count - 1)
+            self.count -= 1
+        self.index.truncate(self.header.size + self.count * self.entry.size)
+        if end is not None:
+            self._segment(self._segment_of(self.first + self.count - 1)).truncate(end)
+        # segments written, but with no block indexed
+        segment = self._segment_of(self.next_number)
+        if self.count % self.segment_blocks:
+            segment += 1
+        while os.path.exists(self._segment_path(segment)):
+            os.remove(self._segment_path(segment))
+            segment += 1
+
+    def _map_index(self):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        if self.count:
+            self.index_map = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _segment_of(self, number):
+        return (number - self.first) // self.segment_blocks
+
+    @property
+    def next_number(self):
+        "number of the next block to append, `None` while empty"
+        if self.first is None:
+            return None
+        return self.first + self.count
+
+    def __contains__(self, number):
+        return self.first is not None and self.first <= number < self.first + self.count
+
+    def __len__(self):
+        return self.count
+
+    def append(self, number, data):
+        if self.first is None:
+            self.first = number
+            self.index_tail.append(self.header.pack(number))
+        assert number == self.next_number, (number, self.next_number)
+        f = self._segment(self._segment_of(number))
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(data)
+        self.index_tail.append(self.entry.pack(offset, len(data)))
+        self.count += 1
+
+    def flush(self):
+        "writes appended blocks to disk, they can be looked up afterwards"
+        for f in self.segments.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.index.write(b''.join(self.index_tail))
+        self.index_tail = []
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self._map_index()
+
+    def get(self, number):
+        "returns the RLP of block `number` or `None` if it is not frozen"
+        if number not in self or self.index_map is None:
+            return None
+        pos = self.header.size + (number - self.first) * self.entry.size
+        if pos + self.entry.size > len(self.index_map):
+            return None  # appended, but not flushed yet
+        offset, length = self.entry.unpack_from(self.index_map, pos)
+        f = self._segment(self._segment_of(number))
+        f.seek(offset)
+        return f.read(length)
+
+    def close(self):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        for f in self.segments.values():
+            f.close()
+        self.segments.clear()
+        self.index.close()
+
+    def __repr__(self):
+        return '<Freezer first=%r count=%d>' % (self.first, self.count)
+
+
+def pointer_key(blockhash):
+    """the key of the pointer to a frozen block, its value is the block number
+
+    Kept apart from the block hash, so that no stored value can be mistaken for a pointer.
+    """
+    return FROZEN + blockhash
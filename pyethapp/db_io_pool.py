@@ -0,0 +1,72 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+import time
+
+from gevent.lock import BoundedSemaphore
+from gevent.threadpool import ThreadPool
+
+
+class IOPool(object):
+
+    """
+    Runs blocking database calls on a threadpool, so that only the calling greenlet waits
+    for them and the hub keeps serving peers, RPC and mining in the meantime.
+
+    At most `size` calls run at the same time and at most `max_queue` further calls wait for
+    a thread. Greenlets issuing calls beyond that are suspended until a slot gets free.
+
+    Timings are collected per operation name: number of calls, time spent waiting for a
+    slot and time spent running.
+    """
+
+    def __init__(self, size=4, max_queue=64):
+        self.size = size
+        self.max_queue = max_queue
+        self.pool = ThreadPool(size)
+        self.slots = BoundedSemaphore(size + max_queue)
+        self.timings = dict()
+
+    def spawn(self, op, func, *args):
+        "schedules `func(*args)`, returns a :class:`gevent.event.AsyncResult`"
+        st = time.time()
+        self.slots.acquire()
+        queued = time.time()
+        elapsed = [0.]
+
+        def timed():
+            started = time.time()
+            try:
+                return func(*args)
+            finally:
+                elapsed[0] = time.time() - started
+
+        def done(_):
+            # runs on the hub, the timings are not touched by the threads
+            self.slots.release()
+            self._record(op, queued - st, elapsed[0])
+
+        result = self.pool.spawn(timed)
+        result.rawlink(done)
+        return result
+
+    def run(self, op, func, *args):
+        "runs `func(*args)` in a thread, blocking only the current greenlet"
+        return self.spawn(op, func, *args).get()
+
+    def _record(self, op, waited, elapsed):
+        t = self.timings.get(op)
+        if t is None:
+            t = self.timings[op] = dict(calls=0, wait=0., time=0., max_time=0.)
+        t['calls'] += 1
+        t['wait'] += waited
+        t['time'] += elapsed
+        t['max_time'] = max(t['max_time'], elapsed)
+
+    def stats(self):
+        return dict(size=self.size, max_queue=self.max_queue,
+                    in_flight=self.size + self.max_queue - self.slots.counter,
+                    timings=dict((op, dict(t)) for op, t in self.timings.items()))
+
+    def kill(self):
+        self.pool.kill()
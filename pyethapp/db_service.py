@@ -1,9 +1,20 @@
 # -*- coding: utf8 -*-
 
 from __future__ import absolute_import
+import itertools
+import os
+import time
+import gevent
+import rlp
+from devp2p.app import BaseApp
 from devp2p.service import BaseService
 from ethereum.db import BaseDB
+from ethereum.experimental.refcount_db import RefcountDB
 from ethereum.slogging import get_logger
+from ethereum.utils import big_endian_to_int
+from .db_bloom import BloomFilter
+from .db_freezer import Freezer, pointer_key
+from .db_stores import BLOCKS, CATEGORIES, TRIE, is_block, key_category
 from .ephemdb_service import EphemDB
 
 log = get_logger('db')
@@ -33,10 +44,95 @@ else:
     dbs['LmDB'] = LmDBService
 
 
+def get_many(db, keys):
+    """Look up several keys in a database at once.
+
+    Uses the native `get_many` of the database if available (also through the
+    :class:`RefcountDB` of a pruning chain, which stores values under `b'r:' + key` as RLP
+    list `[refcount, value]`) and falls back to single lookups otherwise.
+
+    :returns: the values in the order of `keys`, `None` for missing keys
+    """
+    if isinstance(db, RefcountDB):
+        values = get_many(db.db, [b'r:' + key for key in keys])
+        return [rlp.decode(v)[1] if v is not None else None for v in values]
+    if hasattr(db, 'get_many'):
+        return db.get_many(keys)
+    values = []
+    for key in keys:
+        try:
+            values.append(db.get(key))
+        except KeyError:
+            values.append(None)
+    return values
+
+
+def contains_many(db, keys):
+    """Check several keys for existence at once, see :func:`get_many`.
+
+    :returns: a list of booleans in the order of `keys`
+    """
+    if isinstance(db, RefcountDB):
+        return contains_many(db.db, [b'r:' + key for key in keys])
+    if hasattr(db, 'contains_many'):
+        return db.contains_many(keys)
+    return [key in db for key in keys]
+
+
 class DBService(BaseDB, BaseService):
 
+    """
+    Database facade, delegating to the backend selected by `db.implementation`.
+
+    Keys can be routed by category (see :mod:`pyethapp.db_stores`) to separate stores, each
+    with its own backend and options, e.g.::
+
+        db:
+          stores:
+            trie: {read_cache_bytes: 268435456, block_cache_size: 67108864}
+            headers: {implementation: LmDB}
+            index: {implementation: LmDB}
+
+    A store is kept in `data_dir/stores/<category>` and uses the `db` options, overridden by
+    its own ones. Categories without a store of their own are kept in the default backend.
+    Block hashes and trie node hashes look alike, a block put under a hash is recognized by
+    its RLP structure. Commits are not atomic across stores.
+
+    With `db.bloom_filter` enabled, a :class:`BloomFilter` over all stored keys answers
+    lookups of unknown keys without touching the backend. `db.bloom_capacity` has to exceed
+    the number of stored keys, a saturated filter is dropped. It is saved to the data dir on
+    stop and loaded (and removed, so that a crash can not leave a stale one behind) on the
+    next start. Without a snapshot it is rebuilt from the keys of the backend in background
+    after the start, lookups are not filtered until then.
+
+    With `db.freezer_distance` set, canonical blocks that deep are moved to a
+    :class:`Freezer` in background, see :meth:`freeze`.
+    """
+
     name = 'db'
-    default_config = dict(db=dict(implementation='LevelDB'))
+    default_config = dict(db=dict(
+        implementation='LevelDB',
+        read_cache_bytes=64 * 1024**2,
+        flush_keys=0,
+        flush_bytes=0,  # flushes in the middle of a block give up the atomicity of commits
+        background_flush=False,
+        sync_every=None,  # backend default: 0 for LevelDB, 1 (every write) for LMDB
+        io_threads=0,
+        io_queue=64,
+        compression_level=0,
+        compression_dict=None,
+        compression_min_size=64,
+        block_cache_size=8 * 1024**2,
+        write_buffer_size=4 * 1024**2,
+        stores={},
+        bloom_filter=False,
+        bloom_capacity=10 * 1000**2,
+        bloom_error_rate=0.01,
+        freezer_distance=0,
+        freezer_interval=10.,
+        freezer_segment_blocks=100000,
+    ))
+    freezer_batch = 1000  # blocks moved at once, between commits of the chain
 
     def __init__(self, app):
         super(DBService, self).__init__(app)
@@ -44,27 +140,269 @@ class DBService(BaseDB, BaseService):
         if len(dbs) == 0:
             log.warning('No db installed')
         self.db_service = dbs[impl](app)
+        self.stores = dict((category, self.db_service) for category in CATEGORIES)
+        for category, options in (self.app.config['db'].get('stores') or {}).items():
+            self.stores[category] = self._open_store(category, options)
+        self.separate_blocks = self.stores[BLOCKS] is not self.stores[TRIE]
+        self.bloom = None
+        self.bloom_building = None  # filled with the stored keys by bloom_builder
+        self.bloom_builder = None
+        self.bloom_path = None
+        self.bloom_saved = False
+        if self.app.config['db']['bloom_filter'] and \
+                all(hasattr(db, 'iter_keys') for db in self.backends()):
+            self._init_bloom(impl)
+        self.freezer = None
+        self.freezer_mover = None
+        self.freezer_pointers_checked = False
+        self.commit_time = 0.  # accumulated, for timings of the block import
+        if self.app.config['db']['freezer_distance'] and self.app.config.get('data_dir'):
+            self.freezer = Freezer(os.path.join(self.app.config['data_dir'], 'freezer'),
+                                   self.app.config['db']['freezer_segment_blocks'])
+
+    def _open_store(self, category, options):
+        if category not in CATEGORIES:
+            raise ValueError('unknown db store {}, must be one of {}'.format(category, CATEGORIES))
+        config = dict(self.app.config)
+        config['db'] = dict(self.app.config['db'], stores={})
+        config['db'].update(options)
+        if config.get('data_dir'):
+            config['data_dir'] = os.path.join(config['data_dir'], 'stores', category)
+            if not os.path.exists(config['data_dir']):
+                os.makedirs(config['data_dir'])
+        log.info('opening db store', category=category,
+                 implementation=config['db']['implementation'])
+        return dbs[config['db']['implementation']](BaseApp(config))
+
+    def backends(self):
+        "returns the distinct backends, the default one first"
+        backends = [self.db_service]
+        for category in CATEGORIES:
+            if not any(self.stores[category] is db for db in backends):
+                backends.append(self.stores[category])
+        return backends
+
+    def _init_bloom(self, impl):
+        dbconfig = self.app.config['db']
+        if self.app.config.get('data_dir'):
+            self.bloom_path = os.path.join(self.app.config['data_dir'], 'bloom.%s' % impl)
+            self.bloom = BloomFilter.load(self.bloom_path)
+        if self.bloom is not None:
+            log.info('loaded key filter', filter=self.bloom)
+            os.remove(self.bloom_path)
+            return
+        # created now, so that it gets the keys put before the build starts
+        self.bloom_building = BloomFilter(dbconfig['bloom_capacity'],
+                                          dbconfig['bloom_error_rate'])
+
+    def _build_bloom(self):
+        st = time.time()
+        bloom = self.bloom_building
+        for i, key in enumerate(self.iter_keys()):
+            bloom.add(key)
+            if i % 10000 == 0:
+                gevent.sleep(0)
+        self.bloom_building = None
+        if bloom.count > self.app.config['db']['bloom_capacity']:
+            log.warning('key filter saturated, not used, increase db.bloom_capacity',
+                        keys=bloom.count)
+            return
+        self.bloom = bloom
+        log.info('built key filter', filter=self.bloom, elapsed=time.time() - st)
 
     def start(self):
+        for db in self.backends()[1:]:
+            db.start()
+        if self.freezer is not None:
+            self.freezer_mover = gevent.spawn(self._run_freezer)
+        if self.bloom_building is not None:
+            self.bloom_builder = gevent.spawn(self._build_bloom)
         return self.db_service.start()
 
     def _run(self):
         return self.db_service._run()
 
+    def stop(self):
+        if self.freezer_mover is not None:
+            self.freezer_mover.kill()
+        if self.bloom_builder is not None:
+            self.bloom_builder.kill()
+        for db in self.backends():
+            db.stop()
+        if self.freezer is not None:
+            self.freezer.close()
+        if self.bloom is not None and self.bloom_path:
+            self.bloom.save(self.bloom_path)
+            self.bloom_saved = True
+        super(DBService, self).stop()
+
+    def _run_freezer(self):
+        interval = self.app.config['db']['freezer_interval']
+        if b'I am pruning' in self:
+            # values carry refcounts, blocks would be frozen with them
+            log.warning('the freezer does not support pruning databases, not freezing blocks')
+            return
+        while True:
+            try:
+                while self.freeze() == self.freezer_batch:
+                    gevent.sleep(0)
+            except Exception as e:
+                log.error('freezing blocks failed', error=e)
+            gevent.sleep(interval)
+
+    def _head_number(self):
+        try:
+            head_rlp = self.get(self.get(b'head_hash'))
+        except KeyError:
+            return None
+        if head_rlp == b'GENESIS':
+            return None
+        return big_endian_to_int(rlp.decode(head_rlp)[0][8])
+
+    def freeze(self):
+        """Moves the next canonical blocks deeper than `db.freezer_distance` to the freezer.
+
+        The blocks are on disk once the freezer is flushed, the pointers to them and the
+        deletes of the hot copies are committed with the next commit of the chain, so that
+        the writes of a block import running meanwhile are not committed half way. If the
+        process dies in between, the hot copies are still read. On the first call after a
+        start the missing pointers are restored, see :meth:`_restore_pointers`.
+
+        :returns: the number of blocks moved
+        """
+        if not self.freezer_pointers_checked:
+            self._restore_pointers()
+            self.freezer_pointers_checked = True
+        head_number = self._head_number()
+        if head_number is None:
+            return 0
+        number = self.freezer.next_number
+        if number is None:
+            number = int(self.get(b'GENESIS_NUMBER')) + 1
+        last = min(head_number - self.app.config['db']['freezer_distance'],
+                   number + self.freezer_batch - 1)
+        moved = []
+        for number in range(number, last + 1):
+            blockhash = self.get(b'block:%d' % number)
+            self.freezer.append(number, self.get(blockhash))
+            moved.append((number, blockhash))
+        if not moved:
+            return 0
+        # pointers must not be committed before the blocks are on disk
+        self.freezer.flush()
+        for number, blockhash in moved:
+            self.put(pointer_key(blockhash), str(number).encode())
+            self.stores[BLOCKS].delete(blockhash)
+        log.debug('froze blocks', first=moved[0][0], last=moved[-1][0])
+        return len(moved)
+
+    def _restore_pointers(self):
+        "writes the pointers to the last frozen blocks again, if they were not committed"
+        number = self.freezer.next_number
+        restored = 0
+        while number is not None and number - 1 in self.freezer:
+            number -= 1
+            blockhash = self.get(b'block:%d' % number)
+            if pointer_key(blockhash) in self:
+                break
+            self.put(pointer_key(blockhash), str(number).encode())
+            if blockhash in self.stores[BLOCKS]:
+                self.stores[BLOCKS].delete(blockhash)
+            restored += 1
+        if restored:
+            log.info('restored pointers to frozen blocks', num=restored)
+        return restored
+
+    def _thaw(self, number):
+        "returns the frozen block with the number stored in a pointer, `None` if missing"
+        return self.freezer.get(int(number)) if number is not None else None
+
     def get(self, key):
-        return self.db_service.get(key)
+        try:
+            return self._get(key)
+        except KeyError:
+            if self.freezer is None or key_category(key) != TRIE:
+                raise
+        value = self._thaw(self._get(pointer_key(key)))
+        if value is None:
+            raise KeyError('frozen block missing')
+        return value
+
+    def _get(self, key):
+        if self.bloom is not None and key not in self.bloom:
+            raise KeyError('key not in db')
+        category = key_category(key)
+        if category == TRIE and self.separate_blocks:
+            try:
+                return self.stores[TRIE].get(key)
+            except KeyError:
+                return self.stores[BLOCKS].get(key)
+        return self.stores[category].get(key)
+
+    def get_many(self, keys):
+        if self.bloom is not None:
+            maybe = [key for key in keys if key in self.bloom]
+        else:
+            maybe = keys
+        by_category = dict()
+        for key in maybe:
+            by_category.setdefault(key_category(key), []).append(key)
+        values = dict()
+        for category, store_keys in by_category.items():
+            values.update(zip(store_keys, get_many(self.stores[category], store_keys)))
+        if self.separate_blocks and TRIE in by_category:
+            missing = [key for key in by_category[TRIE] if values[key] is None]
+            values.update(zip(missing, get_many(self.stores[BLOCKS], missing)))
+        if self.freezer is not None and TRIE in by_category:
+            missing = [key for key in by_category[TRIE] if values[key] is None]
+            numbers = get_many(self.stores[BLOCKS], [pointer_key(key) for key in missing])
+            values.update(zip(missing, [self._thaw(number) for number in numbers]))
+        return [values.get(key) for key in keys]
+
+    def contains_many(self, keys):
+        if self.bloom is None and len(self.backends()) == 1:
+            return contains_many(self.db_service, keys)
+        return [value is not None for value in self.get_many(keys)]
 
     def put(self, key, value):
-        return self.db_service.put(key, value)
+        if self.bloom is not None:
+            self.bloom.add(key)
+            if self.bloom_saved:
+                # written after stop, the snapshot does not cover this key anymore
+                os.remove(self.bloom_path)
+                self.bloom_saved = False
+        elif self.bloom_building is not None:
+            self.bloom_building.add(key)
+        category = key_category(key)
+        if category == TRIE and self.separate_blocks and is_block(value):
+            category = BLOCKS
+        return self.stores[category].put(key, value)
 
     def commit(self):
-        return self.db_service.commit()
+        st = time.time()
+        for db in self.backends():
+            db.commit()
+        self.commit_time += time.time() - st
 
     def delete(self, key):
-        return self.db_service.delete(key)
+        category = key_category(key)
+        if category == TRIE and self.separate_blocks and key in self.stores[BLOCKS]:
+            category = BLOCKS
+        return self.stores[category].delete(key)
+
+    def iter_keys(self):
+        return itertools.chain(*[db.iter_keys() for db in self.backends()])
 
     def __contains__(self, key):
-        return key in self.db_service
+        if self.bloom is not None and key not in self.bloom:
+            return False
+        category = key_category(key)
+        if category == TRIE and self.separate_blocks and key in self.stores[BLOCKS]:
+            return True
+        if category == TRIE and self.freezer is not None \
+                and pointer_key(key) in self.stores[BLOCKS]:
+            return True
+        return key in self.stores[category]
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.db_service == other.db_service
@@ -0,0 +1,64 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from ethereum.utils import to_string
+
+BLOCKS = 'blocks'    # RLP encoded blocks, keyed by block hash, and pointers to frozen ones
+HEADERS = 'headers'  # RLP encoded headers, keyed by b'header:' + block hash
+TRIE = 'trie'        # state trie nodes, keyed by their hash
+INDEX = 'index'      # number -> hash index and other chain indexes and journals
+RECEIPTS = 'receipts'  # RLP encoded receipts of a block, keyed by b'receipts:' + block hash
+META = 'meta'        # network id, pruning marker, head and genesis pointers
+CATEGORIES = (BLOCKS, HEADERS, TRIE, INDEX, RECEIPTS, META)
+
+PREFIXES = (
+    (b'header:', HEADERS),
+    (b'receipts:', RECEIPTS),
+    (b'frozen:', BLOCKS),
+    (b'block:', INDEX),
+    (b'txindex:', INDEX),
+    (b'child:', INDEX),
+    (b'score:', INDEX),
+    (b'changed:', INDEX),
+    (b'deletes:', INDEX),
+    (b'address:', INDEX),
+)
+
+
+def key_category(key):
+    """Returns the category of `key`.
+
+    Block hashes and trie node hashes can not be told apart, both are reported as `TRIE`,
+    see :func:`value_category`.
+    """
+    key = to_string(key)
+    for prefix, category in PREFIXES:
+        if key.startswith(prefix):
+            return category
+    if len(key) == 32:
+        return TRIE
+    return META
+
+
+def value_category(key, value):
+    "like :func:`key_category`, but tells blocks and trie nodes apart by the stored value"
+    category = key_category(key)
+    if category == TRIE and is_block(value):
+        return BLOCKS
+    return category
+
+
+def is_block(value):
+    """Checks if `value` is an RLP encoded block (or the genesis marker), without decoding it.
+
+    A block is a long list starting with the header, again a long list. Trie nodes never
+    start with a long list, their items are hashes or embedded nodes shorter than 32 bytes.
+    The refcounted values of a pruning database are not checked, they are stored under
+    `b'r:' + key` as RLP list `[refcount, value]`.
+    """
+    value = to_string(value)
+    if value == b'GENESIS':
+        return True
+    if len(value) < 2 or ord(value[0:1]) < 0xf8:
+        return False
+    header_pos = 1 + ord(value[0:1]) - 0xf7
+    return len(value) > header_pos and ord(value[header_pos:header_pos + 1]) >= 0xf8
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+import time
+
+import gevent
+from ethereum.slogging import get_logger
+
+log = get_logger('db')
+
+
+class WriteBuffer(object):
+
+    """
+    Write-behind layer for the disk backed databases.
+
+    Pending writes are collected in `uncommitted` and handed to the backend as one batch on
+    `commit`, or as soon as the buffer grows beyond `flush_keys` entries or `flush_bytes`
+    bytes. While a batch is being written it is kept in `flushing`, so that reads keep seeing
+    it. With `background_flush` the batch is written on the gevent threadpool, the hub keeps
+    serving other greenlets in the meantime. If an :class:`IOPool` is given, all batches are
+    written on it, `commit` then only suspends the calling greenlet.
+
+    flush_keys        (default: 0)       flush once this many keys are pending, 0 disables
+    flush_bytes       (default: 0)       flush once keys and values of all pending writes
+                                         exceed this many bytes, 0 disables
+    background_flush  (default: False)   write batches in a thread instead of on the hub
+    sync_every        (default: 0)       durability: 0 never syncs to disk, 1 syncs every
+                                         write, N syncs every N-th commit
+
+    Implementations provide `_write_batch(items, sync)`, where `items` is a dict of the
+    pending writes as stored in `uncommitted`.
+    """
+
+    def init_write_buffer(self, flush_keys=0, flush_bytes=0, background_flush=False,
+                          sync_every=0, io_pool=None):
+        self.uncommitted = dict()
+        self.uncommitted_bytes = 0
+        self.flushing = dict()
+        self.flushing_bytes = 0
+        self.flush_keys = flush_keys
+        self.flush_bytes = flush_bytes
+        self.background_flush = background_flush
+        self.sync_every = sync_every
+        self.commit_counter = 0
+        self.flush_counter = 0
+        self.flush_time = 0.
+        self._flush_result = None
+        self.io_pool = io_pool
+
+    def _buffer_write(self, key, value, size):
+        "adds a pending write, `size` is the number of bytes it accounts for"
+        if key in self.uncommitted:
+            self.uncommitted_bytes -= self._pending_size(key, self.uncommitted[key])
+        self.uncommitted[key] = value
+        self.uncommitted_bytes += size
+        if (self.flush_keys and len(self.uncommitted) >= self.flush_keys) or \
+                (self.flush_bytes and self.uncommitted_bytes >= self.flush_bytes):
+            log.debug('write buffer full, flushing', keys=len(self.uncommitted),
+                      bytes=self.uncommitted_bytes)
+            self.flush(sync=self.sync_every == 1)
+
+    @staticmethod
+    def _pending_size(key, value):
+        "the `size` a pending write was accounted for, deletes have no value"
+        try:
+            return len(key) + len(value)
+        except TypeError:
+            return len(key)
+
+    def _buffered(self, key, default):
+        "returns the pending value of `key` or `default` if there is none"
+        if key in self.uncommitted:
+            return self.uncommitted[key]
+        return self.flushing.get(key, default)
+
+    def flush(self, sync=False):
+        "hands the pending writes to the backend, in background mode without waiting for them"
+        self.wait_flushed()
+        if not self.uncommitted:
+            return
+        self.flushing, self.uncommitted = self.uncommitted, dict()
+        self.flushing_bytes, self.uncommitted_bytes = self.uncommitted_bytes, 0
+        if self.io_pool is not None:
+            self._flush_result = self.io_pool.spawn('write', self._timed_write_batch,
+                                                    self.flushing, sync)
+            if not self.background_flush:
+                self.wait_flushed()
+        elif self.background_flush:
+            pool = gevent.get_hub().threadpool
+            self._flush_result = pool.spawn(self._timed_write_batch, self.flushing, sync)
+        else:
+            try:
+                self._timed_write_batch(self.flushing, sync)
+            except Exception:
+                self._restore_flushing()
+                raise
+            finally:
+                self.flushing = dict()
+
+    def wait_flushed(self):
+        "blocks the current greenlet until the batch being written in background is on disk"
+        if self._flush_result is None:
+            return
+        result, self._flush_result = self._flush_result, None
+        try:
+            result.get()
+        except Exception:
+            self._restore_flushing()
+            raise
+        finally:
+            self.flushing = dict()
+
+    def _restore_flushing(self):
+        "keeps a batch which failed to be written pending, newer pending writes take precedence"
+        for key, value in self.uncommitted.items():
+            if key in self.flushing:
+                self.flushing_bytes -= self._pending_size(key, self.flushing[key])
+        self.flushing.update(self.uncommitted)
+        self.uncommitted = self.flushing
+        self.uncommitted_bytes += self.flushing_bytes
+
+    def _timed_write_batch(self, items, sync):
+        st = time.time()
+        self._write_batch(items, sync)
+        self.flush_counter += 1
+        self.flush_time += time.time() - st
+
+    def commit(self):
+        log.debug('committing', db=self)
+        self.commit_counter += 1
+        sync = self.sync_every > 0 and self.commit_counter % self.sync_every == 0
+        self.flush(sync=sync)
+        self.wait_flushed()
+        log.debug('committed', db=self, num=len(self.uncommitted))
+
+    def write_buffer_stats(self):
+        return dict(pending_keys=len(self.uncommitted), pending_bytes=self.uncommitted_bytes,
+                    flushing_keys=len(self.flushing), commits=self.commit_counter,
+                    flushes=self.flush_counter, flush_time=self.flush_time)
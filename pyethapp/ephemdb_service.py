@@ -15,6 +15,12 @@ class EphemDB(_EphemDB, BaseService):
         _EphemDB.__init__(self)
         self.stop_event = Event()
 
+    def get_many(self, keys):
+        return [self.db.get(key) for key in keys]
+
+    def contains_many(self, keys):
+        return [key in self.db for key in keys]
+
     def _run(self):
         self.stop_event.wait()
 
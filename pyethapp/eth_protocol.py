@@ -10,10 +10,39 @@ from ethereum.utils import (
 import rlp
 import gevent
 import time
+from collections import OrderedDict
 from ethereum import slogging
+from .rlp_slices import encode_list
 log = slogging.get_logger('protocol.eth')
 
 
+class DuplicatesFilter(object):
+
+    """LRU set of recently seen hashes, all operations are O(1)."""
+
+    def __init__(self, max_items=32768):
+        self.max_items = max_items
+        self.filter = OrderedDict()
+
+    def update(self, data):
+        "returns True if unknown"
+        if data not in self.filter:
+            self.filter[data] = None
+            if len(self.filter) > self.max_items:
+                self.filter.popitem(last=False)
+            return True
+        else:
+            del self.filter[data]  # mark as most recently used
+            self.filter[data] = None
+            return False
+
+    def __contains__(self, v):
+        return v in self.filter
+
+    def __len__(self):
+        return len(self.filter)
+
+
 class TransientBlockBody(rlp.Serializable):
     fields = [
         ('transactions', rlp.sedes.CountableList(Transaction)),
@@ -25,6 +54,8 @@ class TransientBlock(rlp.Serializable):
 
     """A partially decoded, unvalidated block."""
 
+    senders_recovered = False  # set once the senders have been recovered in a batch
+
     fields = [
         ('header', BlockHeader),
         ('transactions', rlp.sedes.CountableList(Transaction)),
@@ -75,10 +106,15 @@ class ETHProtocol(BaseProtocol):
 
     max_getblocks_count = 128
     max_getblockheaders_count = 192
+    max_known_txs = 32768
+    max_known_blocks = 1024
 
     def __init__(self, peer, service):
         # required by P2PProtocol
         self.config = peer.config
+        # hashes of the txs and blocks sent to or received from the peer
+        self.known_txs = DuplicatesFilter(self.max_known_txs)
+        self.known_blocks = DuplicatesFilter(self.max_known_blocks)
         BaseProtocol.__init__(self, peer, service)
 
     class status(BaseProtocol.command):
@@ -125,6 +161,16 @@ class ETHProtocol(BaseProtocol):
             ]
         structure = rlp.sedes.CountableList(Data)
 
+        def create(self, proto, *newblockhashes):
+            for data in newblockhashes:
+                proto.known_blocks.update(data.hash)
+            return newblockhashes
+
+        def receive(self, proto, data):
+            for d in data:
+                proto.known_blocks.update(d.hash)
+            BaseProtocol.command.receive(self, proto, data)
+
     class transactions(BaseProtocol.command):
 
         """
@@ -137,7 +183,15 @@ class ETHProtocol(BaseProtocol):
         cmd_id = 2
         structure = rlp.sedes.CountableList(Transaction)
 
-        # todo: bloomfilter: so we don't send tx to the originating peer
+        def create(self, proto, *transactions):
+            for tx in transactions:
+                proto.known_txs.update(tx.hash)
+            return transactions
+
+        def receive(self, proto, data):
+            for tx in data:
+                proto.known_txs.update(tx.hash)
+            BaseProtocol.command.receive(self, proto, data)
 
         @classmethod
         def decode_payload(cls, rlp_data):
@@ -223,12 +277,19 @@ class ETHProtocol(BaseProtocol):
         structure = rlp.sedes.CountableList(TransientBlockBody)
 
         def create(self, proto, *bodies):
+            "bodies are blocks, TransientBlockBody objects or RLP encoded bodies"
             if len(bodies) == 0:
                 return []
             if isinstance(bodies[0], Block):
                 bodies = [TransientBlockBody(b.transactions, b.uncles) for b in bodies]
             return bodies
 
+        @classmethod
+        def encode_payload(cls, data):
+            if data and isinstance(data[0], bytes):  # sent as they are, see block_body
+                return encode_list(data)
+            return BaseProtocol.command.encode_payload.__func__(cls, data)
+
     class newblock(BaseProtocol.command):
 
         """
@@ -240,7 +301,13 @@ class ETHProtocol(BaseProtocol):
         cmd_id = 7
         structure = [('block', Block), ('chain_difficulty', rlp.sedes.big_endian_int)]
 
-        # todo: bloomfilter: so we don't send block to the originating peer
+        def create(self, proto, block, chain_difficulty):
+            proto.known_blocks.update(block.header.hash)
+            return [block, chain_difficulty]
+
+        def receive(self, proto, data):
+            proto.known_blocks.update(data['block'].header.hash)
+            BaseProtocol.command.receive(self, proto, data)
 
         @classmethod
         def decode_payload(cls, rlp_data):
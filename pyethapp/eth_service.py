@@ -5,10 +5,12 @@ from builtins import str
 from builtins import range
 from past.utils import old_div
 from builtins import object
-import copy
+import itertools
+import math
+import os
+import random
 import time
-import statistics
-from collections import deque
+from collections import OrderedDict
 
 import gevent
 import gevent.lock
@@ -20,15 +22,17 @@ import rlp
 from devp2p.protocol import BaseProtocol
 from devp2p.service import WiredService
 
-from ethereum.block import Block
-from ethereum.meta import make_head_candidate
+from ethereum.block import Block, BlockHeader
+from ethereum.common import mk_block_from_prevstate, add_transactions, set_execution_results
+from ethereum.consensus_strategy import get_consensus_strategy
+from ethereum.meta import apply_block
 from ethereum.pow.chain import Chain
 from ethereum.pow.consensus import initialize, check_pow
 from ethereum.config import Env
 from ethereum.genesis_helpers import mk_genesis_data
 from ethereum import config as ethereum_config
 from ethereum.messages import apply_transaction, validate_transaction
-from ethereum.transaction_queue import TransactionQueue
+from ethereum.state import State
 from ethereum.experimental.refcount_db import RefcountDB
 from ethereum.slogging import get_logger
 from ethereum.exceptions import InvalidTransaction, InvalidNonce, \
@@ -36,11 +40,19 @@ from ethereum.exceptions import InvalidTransaction, InvalidNonce, \
 from ethereum.transactions import Transaction
 from ethereum.utils import (
     encode_hex,
+    sha3,
     to_string,
 )
 
 from .synchronizer import Synchronizer
 from . import eth_protocol
+from .eth_protocol import DuplicatesFilter
+from .db_service import get_many
+from .sender_recovery import SenderRecoveryPool
+from .receipts_store import ReceiptsStore
+from .txpool import TxPool
+from .rlp_slices import list_items, block_body
+from .histogram import Histogram
 
 from pyethapp import sentry
 from pyethapp.dao import is_dao_challenge, build_dao_header
@@ -48,25 +60,90 @@ from pyethapp.dao import is_dao_challenge, build_dao_header
 log = get_logger('eth.chainservice')
 
 
-class DuplicatesFilter(object):
+class BlockQueue(Queue):
 
-    def __init__(self, max_items=128):
-        self.max_items = max_items
-        self.filter = list()
+    """
+    Queue of tuples starting with a block (or TransientBlock), with an index of the queued
+    block hashes. `END`, which is not indexed, marks the end of a stream of blocks.
+    """
 
-    def update(self, data):
-        "returns True if unknown"
-        if data not in self.filter:
-            self.filter.append(data)
-            if len(self.filter) > self.max_items:
-                self.filter.pop(0)
-            return True
+    END = (None, None, None)
+
+    def __init__(self, maxsize=None):
+        self.hashes = dict()  # block hash: number of queued entries
+        Queue.__init__(self, maxsize)
+
+    def _put(self, item):
+        if item[0] is not None:
+            block_hash = item[0].header.hash
+            self.hashes[block_hash] = self.hashes.get(block_hash, 0) + 1
+        Queue._put(self, item)
+
+    def _get(self):
+        item = Queue._get(self)
+        if item[0] is None:
+            return item
+        block_hash = item[0].header.hash
+        if self.hashes[block_hash] == 1:
+            del self.hashes[block_hash]
         else:
-            self.filter.append(self.filter.pop(0))
-            return False
+            self.hashes[block_hash] -= 1
+        return item
+
+    def __contains__(self, block_hash):
+        return block_hash in self.hashes
+
+
+class BlockBuffer(object):
 
-    def __contains__(self, v):
-        return v in self.filter
+    """
+    Decoded blocks whose parent is not in the chain yet, keyed by their parent hash, so that
+    blocks arriving out of order are added once their parent is. At most `max_size` blocks
+    are kept, for at most `max_age` seconds.
+    """
+
+    def __init__(self, max_size=256, max_age=60.):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = OrderedDict()  # block hash: (timestamp, (block, t_block, proto))
+        self.children = dict()  # parent hash: set of block hashes
+
+    def __len__(self):
+        self.expire()
+        return len(self.entries)
+
+    def __contains__(self, block_hash):
+        self.expire()
+        return block_hash in self.entries
+
+    def add(self, block, t_block, proto):
+        if block.header.hash in self.entries:
+            return
+        self.entries[block.header.hash] = (time.time(), (block, t_block, proto))
+        self.children.setdefault(block.header.prevhash, set()).add(block.header.hash)
+        self.expire()
+
+    def _remove(self, block_hash):
+        _, entry = self.entries.pop(block_hash)
+        prevhash = entry[0].header.prevhash
+        self.children[prevhash].discard(block_hash)
+        if not self.children[prevhash]:
+            del self.children[prevhash]
+        return entry
+
+    def expire(self):
+        "drops the blocks buffered for too long, then the oldest ones while above `max_size`"
+        deadline = time.time() - self.max_age
+        while self.entries:
+            block_hash, (timestamp, _) = next(iter(self.entries.items()))
+            if timestamp >= deadline and len(self.entries) <= self.max_size:
+                break
+            log.debug('dropping buffered block', block=self._remove(block_hash)[0])
+
+    def pop_children(self, parent_hash):
+        "removes and returns the (block, t_block, proto) entries of the children of the block"
+        self.expire()
+        return [self._remove(h) for h in list(self.children.get(parent_hash, ()))]
 
 
 class DAOChallenger(object):
@@ -109,7 +186,9 @@ class ChainService(WiredService):
     # required by BaseService
     name = 'chain'
     default_config = dict(
-        eth=dict(network_id=0, genesis='', pruning=-1),
+        eth=dict(network_id=0, genesis='', pruning=-1, sender_recovery_processes=0,
+                 txpool_max_txs=4096, txpool_max_bytes=32 * 1024**2,
+                 block_propagation='sqrt', badblocks_endpoint=sentry.DEFAULT_ENDPOINT),
         block=ethereum_config.default_config
     )
 
@@ -122,6 +201,22 @@ class ChainService(WiredService):
     synchronizer = None
     config = None
     block_queue_size = 1024
+    # blocks deserialized ahead of execution. Their proof of work is checked when they are
+    # decoded, pyethereum caches the results of the last 32 checks, including those of
+    # uncles (up to 2 per block). With this depth the checks of a block are still cached
+    # when the seal is checked again on execution.
+    decoded_queue_size = 8
+    block_buffer_size = 256  # blocks waiting for their parent
+    block_buffer_max_age = 60.
+    # per block timings: sender recovery, deserialization, proof of work, execution including
+    # the state commit, commit of the database writes, and receipt of a newblock to import
+    import_stages = ('recover', 'decode', 'pow', 'execute', 'write', 'newblock')
+    sender_recovery_blocks = 32  # queued blocks whose senders are recovered in one batch
+    broadcast_filter_size = 32768
+    max_pending_announcements = 256  # broadcasted blocks to be announced once imported
+    tx_batch_size = 256  # transactions per message to a peer
+    tx_batch_interval = 0.05  # max. seconds a transaction is buffered before being sent
+    receipts_cache_size = 256  # blocks with decoded receipts kept in memory
     processed_gas = 0
     processed_elapsed = 0
     process_time_queue_period = 5
@@ -162,6 +257,15 @@ class ChainService(WiredService):
         assert self.db is not None
 
         super(ChainService, self).__init__(app)
+        num_processes = sce.get('sender_recovery_processes', 0)
+        self.sender_recovery = SenderRecoveryPool(num_processes) if num_processes else None
+        self.bad_block_reporter = None
+        if sce.get('badblocks_endpoint', sentry.DEFAULT_ENDPOINT):
+            spool_dir = os.path.join(self.config['data_dir'], 'badblocks') \
+                if self.config.get('data_dir') else None
+            self.bad_block_reporter = sentry.BadBlockReporter(
+                sce.get('badblocks_endpoint', sentry.DEFAULT_ENDPOINT), spool_dir)
+            self.bad_block_reporter.start()
         log.info('initializing chain')
         coinbase = app.services.accounts.coinbase
         env = Env(self.db, sce['block'])
@@ -179,25 +283,46 @@ class ChainService(WiredService):
                 "Genesis hash mismatch.\n  Expected: %s\n  Got: %s" % (
                     sce['genesis_hash'], self.chain.genesis.hex_hash)
 
+        self.receipts = ReceiptsStore(self.db, self.receipts_cache_size)
         self.dao_challenges = dict()
         self.synchronizer = Synchronizer(self, force_sync=None)
 
-        self.block_queue = Queue(maxsize=self.block_queue_size)
-        # When the transaction_queue is modified, we must set
+        self.block_queue = BlockQueue(maxsize=self.block_queue_size)
+        self.decoded_queue = BlockQueue(maxsize=self.decoded_queue_size)
+        self.block_buffer = BlockBuffer(self.block_buffer_size, self.block_buffer_max_age)
+        self.import_timings = dict((stage, Histogram()) for stage in self.import_stages)
+        # When transactions are removed from the txpool, we must set
         # self._head_candidate_needs_updating to True in order to force the
-        # head candidate to be updated.
-        self.transaction_queue = TransactionQueue()
+        # head candidate to be rebuilt.
+        self.txpool = TxPool(sce.get('txpool_max_txs', 4096),
+                             sce.get('txpool_max_bytes', 32 * 1024**2))
         self._head_candidate_needs_updating = True
+        self._head_candidate_pending_txs = []  # queued since the head candidate was built
+        self.head_candidate_stats = dict(rebuilds=0, rebuild_time=0.,
+                                         extensions=0, extension_time=0.)
         # Initialize a new head candidate.
         _ = self.head_candidate
         self.min_gasprice = 20 * 10**9 # TODO: better be an option to validator service?
         self.add_blocks_lock = False
         self.add_transaction_lock = gevent.lock.Semaphore()
-        self.broadcast_filter = DuplicatesFilter()
+        self.broadcast_filter = DuplicatesFilter(self.broadcast_filter_size)
+        assert sce.get('block_propagation', 'sqrt') in ('sqrt', 'all')
+        self.block_propagation = sce.get('block_propagation', 'sqrt')
+        self.pending_announcements = OrderedDict()  # block hash: (header, timestamp)
+        self.propagation_stats = dict(full=0, announced=0)
+        self.propagation_delay = Histogram()  # from receipt to the last send of a block
+        self.tx_outbox = dict()  # proto: (transactions to be sent, timer of the flush)
+        self.tx_batch_sizes = Histogram(resolution=1)
         self.on_new_head_cbs = []
-        self.newblock_processing_times = deque(maxlen=1000)
         gevent.spawn_later(self.process_time_queue_period, self.process_time_queue)
 
+    def stop(self):
+        if self.sender_recovery is not None:
+            self.sender_recovery.stop()
+        if self.bad_block_reporter is not None:
+            self.bad_block_reporter.stop()
+        super(ChainService, self).stop()
+
     @property
     def is_syncing(self):
         return self.synchronizer.synctask is not None
@@ -218,35 +343,123 @@ class ChainService(WiredService):
         finally:
             gevent.spawn_later(self.process_time_queue_period, self.process_time_queue)
 
-    # TODO: Move to pyethereum
     def get_receipts(self, block):
-        # Receipts are no longer stored in the database, so need to generate
-        # them on the fly here.
+        """Returns the receipts of `block`.
+
+        Receipts are stored when a block becomes the head. Those of other blocks are generated
+        by executing the block on its parent state once and are stored afterwards.
+        """
+        receipts = self.receipts.get(block.hash)
+        if receipts is not None:
+            return receipts
         temp_state = self.chain.mk_poststate_of_blockhash(block.header.prevhash)
         initialize(temp_state, block)
         for tx in block.transactions:
             apply_transaction(temp_state, tx)
+        if self.chain.has_blockhash(block.hash):
+            self.receipts.put(block.hash, temp_state.receipts)
         return temp_state.receipts
 
+    def backfill_receipts(self, start=1, commit_every=1000):
+        """Stores the receipts of the canonical blocks from number `start` to the head.
+
+        The blocks are executed in sequence on a single state, so the state of the parent of
+        `start` must be available.
+
+        :returns: the number of blocks whose receipts were stored
+        """
+        head_number = self.chain.head.number
+        state = None
+        stored = 0
+        for number in range(start, head_number + 1):
+            block = self.chain.get_block_by_number(number)
+            if block.hash in self.receipts:
+                state = None  # the next missing block starts from its parent again
+                continue
+            if state is None:
+                state = self.chain.mk_poststate_of_blockhash(block.header.prevhash)
+            apply_block(state, block)
+            self.receipts.put(block.hash, state.receipts)
+            stored += 1
+            if stored % commit_every == 0:
+                self.db.commit()
+                log.info('backfilled receipts', number=number, head=head_number)
+        self.db.commit()
+        return stored
+
     def _on_new_head(self, block):
         log.debug('new head cbs', num=len(self.on_new_head_cbs))
-        self.transaction_queue = self.transaction_queue.diff(
-            block.transactions)
+        self.txpool.remove_included(block.transactions)
         self._head_candidate_needs_updating = True
         for cb in self.on_new_head_cbs:
             cb(block)
 
     @property
     def head_candidate(self):
+        """
+        The block to mine next, with the queued transactions.
+
+        It is built from scratch on a new head only. Transactions queued afterwards are
+        applied on top of the unsealed candidate state, unless one of them fails, e.g. because
+        of a nonce gap, in which case the whole queue is considered again.
+        """
+        if self._head_candidate_pending_txs and not self._head_candidate_needs_updating:
+            self._extend_head_candidate()
         if self._head_candidate_needs_updating:
             self._head_candidate_needs_updating = False
-            # Make a copy of self.transaction_queue because
-            # make_head_candidate modifies it.
-            txqueue = copy.deepcopy(self.transaction_queue)
-            self._head_candidate, self._head_candidate_state = make_head_candidate(
-                self.chain, txqueue, timestamp=int(time.time()))
+            self._rebuild_head_candidate()
         return self._head_candidate
 
+    def _rebuild_head_candidate(self):
+        st = time.time()
+        self._head_candidate_pending_txs = []
+        state = State.from_snapshot(self.chain.state.to_snapshot(root_only=True), self.chain.env)
+        block = mk_block_from_prevstate(self.chain, state, timestamp=int(time.time()))
+        consensus = get_consensus_strategy(self.chain.env.config)
+        block.uncles = consensus.get_uncles(self.chain, state)
+        block.header.uncles_hash = sha3(rlp.encode(block.uncles))
+        consensus.initialize(state, block)
+        add_transactions(state, block, self.txpool.selection())
+        # the unsealed candidate, without block rewards; also used to validate new txs
+        self._head_candidate_block = block
+        self._head_candidate_state = state
+        self._seal_head_candidate()
+        elapsed = time.time() - st
+        self.head_candidate_stats['rebuilds'] += 1
+        self.head_candidate_stats['rebuild_time'] += elapsed
+        log.debug('head candidate rebuilt', txs=len(block.transactions), elapsed=elapsed)
+
+    def _extend_head_candidate(self):
+        st = time.time()
+        txs, self._head_candidate_pending_txs = self._head_candidate_pending_txs, []
+        state, block = self._head_candidate_state, self._head_candidate_block
+        for tx in txs:
+            try:
+                apply_transaction(state, tx)
+            except InvalidTransaction as e:
+                log.debug('rebuilding head candidate', tx=tx, error=e)
+                self._head_candidate_needs_updating = True
+                return
+            block.transactions.append(tx)
+        self._seal_head_candidate()
+        elapsed = time.time() - st
+        self.head_candidate_stats['extensions'] += 1
+        self.head_candidate_stats['extension_time'] += elapsed
+        log.debug('head candidate extended', txs=len(txs), elapsed=elapsed)
+
+    def _seal_head_candidate(self):
+        "applies the block rewards and roots to a copy of the candidate, keeping its state"
+        state, block = self._head_candidate_state, self._head_candidate_block
+        state.commit()  # the revert below can not undo uncommitted changes
+        snapshot = state.snapshot()
+        header = BlockHeader(**dict((name, getattr(block.header, name))
+                                    for name, _ in BlockHeader.fields))
+        sealed = Block(header, list(block.transactions), list(block.uncles))
+        get_consensus_strategy(self.chain.env.config).finalize(state, sealed)
+        set_execution_results(state, sealed)
+        state.revert(snapshot)
+        self._head_candidate = sealed
+
     def add_transaction(self, tx, origin=None, force_broadcast=False, force=False):
         if self.is_syncing:
             if force_broadcast:
@@ -262,17 +475,12 @@ class ChainService(WiredService):
             log.debug('discarding known tx')  # discard early
             return
 
-        # validate transaction
-        try:
-            # Transaction validation for broadcasting. Transaction is validated
-            # against the current head candidate.
-            validate_transaction(self._head_candidate_state, tx)
-
+        future = self._check_transaction(tx)
+        if future is None:
+            return
+        if not future:
             log.debug('valid tx, broadcasting')
             self.broadcast_transaction(tx, origin=origin)  # asap
-        except InvalidTransaction as e:
-            log.debug('invalid tx', error=e)
-            return
 
         if origin is not None:  # not locally added via jsonrpc
             if not self.is_mining or self.is_syncing:
@@ -280,18 +488,177 @@ class ChainService(WiredService):
                 return
 
         if tx.gasprice >= self.min_gasprice:
-            self.add_transaction_lock.acquire()
-            self.transaction_queue.add_transaction(tx, force=force)
-            self._head_candidate_needs_updating = True
-            self.add_transaction_lock.release()
+            self._admit_transaction(tx, future, force)
         else:
             log.info("too low gasprice, ignore", tx=encode_hex(tx.hash)[:8], gasprice=tx.gasprice)
 
+    def _check_transaction(self, tx, state=None):
+        """Validates the transaction against `state`, by default the head candidate's.
+
+        :returns: `None` if it is invalid, else whether its nonce is a future one, i.e. it has
+                  to be queued in the txpool until the gap is filled
+        """
+        state = state or self._head_candidate_state
+        try:
+            validate_transaction(state, tx)
+            return False
+        except InvalidNonce as e:
+            if tx.nonce < state.get_nonce(tx.sender):
+                log.debug('invalid tx', error=e)
+                return None
+        except InvalidTransaction as e:
+            log.debug('invalid tx', error=e)
+            return None
+        # run the remaining checks, e.g. balance and gas, as if the nonce gap was filled
+        state = state.ephemeral_clone()
+        state.set_nonce(tx.sender, tx.nonce)
+        try:
+            validate_transaction(state, tx)
+        except InvalidTransaction as e:
+            log.debug('invalid tx', error=e)
+            return None
+        log.debug('future nonce, not broadcasting', tx=tx)
+        return True
+
+    def _executable_transactions(self, promoted):
+        """Re-validates transactions of a sender which became pending together.
+
+        The queued ones among them were checked against the state at the time they arrived,
+        so they are checked again on top of the head candidate state, each one charged with
+        the cost of those before it.
+
+        :returns: the leading transactions of `promoted` which are valid
+        """
+        state = self._head_candidate_state.ephemeral_clone()
+        for i, tx in enumerate(promoted):
+            state.set_nonce(tx.sender, tx.nonce)
+            try:
+                validate_transaction(state, tx)
+            except InvalidTransaction as e:
+                log.debug('promoted tx invalid, not broadcasting', tx=tx, error=e)
+                return promoted[:i]
+            state.delta_balance(tx.sender, -(tx.value + tx.gasprice * tx.startgas))
+        return promoted
+
+    def _admit_transaction(self, tx, future, force=False):
+        "adds a checked transaction to the txpool and broadcasts the ones it made executable"
+        with self.add_transaction_lock:
+            promoted = self.txpool.add(tx, self.chain.state.get_nonce(tx.sender), force=force)
+            if promoted:
+                self._head_candidate_pending_txs.extend(promoted)
+        if promoted and (future or len(promoted) > 1):
+            for pending_tx in self._executable_transactions(promoted):
+                if pending_tx is not tx or future:  # broadcast once executable
+                    self.broadcast_transaction(pending_tx)
+
+    def add_transactions(self, transactions, origin=None):
+        """Admits a batch of transactions, e.g. those of a `transactions` message.
+
+        Like :meth:`add_transaction`, but known transactions are dropped before any work is
+        done, the senders are recovered together (in the worker processes, if enabled) and
+        the transactions are validated per sender in one pass. The admitted ones are
+        broadcast in one message per peer.
+        """
+        if self.is_syncing:
+            return  # we can not evaluate the txs based on outdated state
+        fresh = self._fresh_transactions(transactions)
+        log.debug('add_transactions', num=len(transactions), new=len(fresh))
+        if not fresh:
+            return
+        if self.sender_recovery is not None:
+            self.sender_recovery.recover(fresh)
+        valid = self._validate_transactions(fresh)
+        self.broadcast_transactions([tx for tx, future in valid if not future], origin=origin)
+
+        if origin is not None:  # not locally added via jsonrpc
+            if not self.is_mining or self.is_syncing:
+                log.debug('discarding txs', syncing=self.is_syncing, mining=self.is_mining)
+                return
+
+        executable = []
+        with self.add_transaction_lock:
+            for tx, future in valid:
+                if tx.gasprice < self.min_gasprice:
+                    log.debug('too low gasprice, ignore', tx=tx, gasprice=tx.gasprice)
+                    continue
+                promoted = self.txpool.add(tx, self.chain.state.get_nonce(tx.sender))
+                if promoted:
+                    self._head_candidate_pending_txs.extend(promoted)
+                    if future or len(promoted) > 1:
+                        executable.extend(t for t in self._executable_transactions(promoted)
+                                          if t is not tx or future)
+        self.broadcast_transactions(executable)
+
+    def _fresh_transactions(self, transactions):
+        "returns the transactions which are neither known nor repeated in the batch"
+        seen = set()
+        fresh = []
+        for tx in transactions:
+            if tx.hash in seen or tx.hash in self.broadcast_filter or tx.hash in self.txpool:
+                continue
+            seen.add(tx.hash)
+            fresh.append(tx)
+        return fresh
+
+    def _validate_transactions(self, transactions):
+        """Checks a batch of transactions with `validate_transaction`, like add_transaction.
+
+        The transactions of a sender are checked in nonce order against a clone of the head
+        candidate state, in which the valid ones are charged their nonce and up-front cost, so
+        that consecutive ones of the same sender can be admitted together.
+
+        :returns: a list of (tx, future), in the order of `transactions`
+        """
+        state = self._head_candidate_state.ephemeral_clone()
+        by_sender = dict()
+        for tx in transactions:
+            try:
+                by_sender.setdefault(tx.sender, []).append(tx)
+            except InvalidTransaction as e:  # invalid signature
+                log.debug('invalid tx', error=e)
+        future = dict()  # tx hash: future
+        for txs in by_sender.values():
+            for tx in sorted(txs, key=lambda tx: tx.nonce):
+                is_future = self._check_transaction(tx, state)
+                if is_future is None:
+                    continue
+                future[tx.hash] = is_future
+                if not is_future:
+                    state.increment_nonce(tx.sender)
+                    state.delta_balance(tx.sender, -(tx.value + tx.gasprice * tx.startgas))
+        return [(tx, future[tx.hash]) for tx in transactions if tx.hash in future]
+
     def check_header(self, header):
         return check_pow(self.chain.state, header)
 
+    def get_blockhashes_by_number(self, numbers):
+        "batched chain.get_blockhash_by_number, `None` for unknown numbers"
+        return get_many(self.chain.db, [b'block:%d' % n for n in numbers])
+
+    def get_blocks_rlp(self, blockhashes):
+        "batched lookup of RLP encoded blocks, `None` for unknown blocks"
+        known = [h for h in blockhashes if h is not None]
+        blocks_rlp = dict(zip(known, get_many(self.chain.db, known)))
+        result = []
+        for blockhash in blockhashes:
+            block_rlp = blocks_rlp.get(blockhash)
+            if block_rlp == b'GENESIS':
+                block_rlp = self.chain.db.get(b'GENESIS_RLP')
+            result.append(block_rlp)
+        return result
+
+    def get_blocks(self, blockhashes):
+        "batched chain.get_block, `None` for unknown blocks"
+        return [rlp.decode(block_rlp, Block) if block_rlp is not None else None
+                for block_rlp in self.get_blocks_rlp(blockhashes)]
+
     def add_block(self, t_block, proto):
         "adds a block to the block_queue and spawns _add_block if not running"
+        block_hash = t_block.header.hash
+        if block_hash in self.block_queue or block_hash in self.decoded_queue \
+                or block_hash in self.block_buffer:
+            log.debug('already queued', block=t_block, proto=proto)
+            return
         self.block_queue.put((t_block, proto))  # blocks if full
         if not self.add_blocks_lock:
             self.add_blocks_lock = True  # need to lock here (ctx switch is later)
@@ -302,8 +669,9 @@ class ChainService(WiredService):
         assert isinstance(block, Block)
         if self.chain.add_block(block):
             log.debug('added', block=block, ts=time.time())
+            self._store_header(block.hash, rlp.encode(block.header))
             assert block == self.chain.head
-            self.transaction_queue = self.transaction_queue.diff(block.transactions)
+            self.txpool.remove_included(block.transactions)
             self._head_candidate_needs_updating = True
             self.broadcast_newblock(block, chain_difficulty=self.chain.get_score(block))
             return True
@@ -311,168 +679,355 @@ class ChainService(WiredService):
         return False
 
     def knows_block(self, block_hash):
-        "if block is in chain or in queue"
+        """if block is in chain or in queue
+
+        Blocks waiting for their parent do not count, so that the synchronizer still fetches
+        the missing ancestors when they are announced again.
+        """
         if self.chain.has_blockhash(block_hash):
             return True
-        # check if queued or processed
-        for i in range(len(self.block_queue.queue)):
-            if block_hash == self.block_queue.queue[i][0].header.hash:
-                return True
-        return False
+        # check if queued or processed (being processed blocks are only peeked)
+        return block_hash in self.block_queue or block_hash in self.decoded_queue
 
     def _add_blocks(self):
+        """
+        Imports the queued blocks in a pipeline of two greenlets, connected by the bounded
+        `decoded_queue`: :meth:`_decode_blocks` recovers senders and deserializes blocks
+        ahead of :meth:`_execute_blocks`, which adds them to the chain. With sender recovery
+        processes the signatures of upcoming blocks are checked while blocks are executed.
+        """
         log.debug('add_blocks', qsize=self.block_queue.qsize(),
                   add_tx_lock=self.add_transaction_lock.locked())
         assert self.add_blocks_lock is True
         self.add_transaction_lock.acquire()
         try:
-            while not self.block_queue.empty():
-                # sleep at the beginning because continue keywords will skip bottom
-                gevent.sleep(0.001)
-
-                t_block, proto = self.block_queue.peek()  # peek: knows_block while processing
-                if self.chain.has_blockhash(t_block.header.hash):
-                    log.warn('known block', block=t_block)
-                    self.block_queue.get()
-                    continue
-                if not self.chain.has_blockhash(t_block.header.prevhash):
-                    log.warn('missing parent', block=t_block, head=self.chain.head)
-                    self.block_queue.get()
-                    continue
-                try:  # deserialize
-                    st = time.time()
-                    block = t_block.to_block()
-                    elapsed = time.time() - st
-                    log.debug('deserialized', elapsed='%.4fs' % elapsed, ts=time.time(),
-                              gas_used=block.gas_used, gpsec=self.gpsec(block.gas_used, elapsed))
-                except InvalidTransaction as e:
-                    log.warn('invalid transaction', block=t_block, error=e, FIXME='ban node')
-                    errtype = \
-                        'InvalidNonce' if isinstance(e, InvalidNonce) else \
-                        'NotEnoughCash' if isinstance(e, InsufficientBalance) else \
-                        'OutOfGasBase' if isinstance(e, InsufficientStartGas) else \
-                        'other_transaction_error'
-                    sentry.warn_invalid(t_block, errtype)
-                    self.block_queue.get()
-                    continue
-                except VerificationFailed as e:
-                    log.warn('verification failed', error=e, FIXME='ban node')
-                    sentry.warn_invalid(t_block, 'other_block_error')
-                    self.block_queue.get()
-                    continue
-
-                # All checks passed
-                log.debug('adding', block=block, ts=time.time())
-                if self.chain.add_block(block):
-                    now = time.time()
-                    log.info('added', block=block, txs=block.transaction_count,
-                             gas_used=block.gas_used)
-                    if t_block.newblock_timestamp:
-                        total = now - t_block.newblock_timestamp
-                        self.newblock_processing_times.append(total)
-                        avg = statistics.mean(self.newblock_processing_times)
-                        med = statistics.median(self.newblock_processing_times)
-                        max_ = max(self.newblock_processing_times)
-                        min_ = min(self.newblock_processing_times)
-                        log.info('processing time', last=total, avg=avg, max=max_, min=min_,
-                                 median=med)
-                    if self.is_mining:
-                        self.transaction_queue = self.transaction_queue.diff(block.transactions)
-                else:
-                    log.warn('could not add', block=block)
-
-                self.block_queue.get()  # remove block from queue (we peeked only)
+            while not self.block_queue.empty():  # blocks added while the pipeline drained
+                decoder = gevent.spawn(self._decode_blocks)
+                try:
+                    self._execute_blocks()
+                finally:
+                    decoder.kill()
         finally:
             self.add_blocks_lock = False
             self.add_transaction_lock.release()
 
+    def _decode_blocks(self):
+        try:
+            self._decode_queued_blocks()
+        except Exception as e:  # the executor must not wait for the failed block forever
+            failed = self.block_queue.get()[0] if not self.block_queue.empty() else None
+            log.error('decoding block failed', error=e, block=failed)
+        self.decoded_queue.put(BlockQueue.END)
+
+    def _decode_queued_blocks(self):
+        while not self.block_queue.empty():
+            gevent.sleep(0)
+            t_block, proto = self.block_queue.peek()  # peek: knows_block while processing
+            if self.chain.has_blockhash(t_block.header.hash):
+                log.warn('known block', block=t_block)
+                self.block_queue.get()
+                continue
+            if self.sender_recovery is not None and not t_block.senders_recovered:
+                st = time.time()
+                num_blocks = self._recover_queued_senders()
+                self._count_stage('recover', num_blocks, time.time() - st)
+            try:  # deserialize
+                st = time.time()
+                block = t_block.to_block()
+                elapsed = time.time() - st
+                self._count_stage('decode', 1, elapsed)
+                log.debug('deserialized', elapsed='%.4fs' % elapsed, ts=time.time(),
+                          gas_used=block.gas_used, gpsec=self.gpsec(block.gas_used, elapsed))
+            except InvalidTransaction as e:
+                log.warn('invalid transaction', block=t_block, error=e, FIXME='ban node')
+                errtype = \
+                    'InvalidNonce' if isinstance(e, InvalidNonce) else \
+                    'NotEnoughCash' if isinstance(e, InsufficientBalance) else \
+                    'OutOfGasBase' if isinstance(e, InsufficientStartGas) else \
+                    'other_transaction_error'
+                self.report_bad_block(t_block, errtype)
+                self.block_queue.get()
+                continue
+            except VerificationFailed as e:
+                log.warn('verification failed', error=e, FIXME='ban node')
+                self.report_bad_block(t_block, 'other_block_error')
+                self.block_queue.get()
+                continue
+            try:  # the result is cached for the check in chain.add_block, see decoded_queue_size
+                st = time.time()
+                self.check_header(block.header)
+                self._count_stage('pow', 1, time.time() - st)
+            except AssertionError:
+                log.warn('invalid proof of work', block=t_block, FIXME='ban node')
+                self.report_bad_block(t_block, 'other_block_error')
+                self.block_queue.get()
+                continue
+            self.decoded_queue.put((block, t_block, proto))  # waits while execution lags
+            self.block_queue.get()
+
+    def _execute_blocks(self):
+        while True:
+            gevent.sleep(0)
+            block, t_block, proto = self.decoded_queue.peek()
+            if block is None:
+                self.decoded_queue.get()
+                return
+            self._execute_block(block, t_block, proto)
+            self.decoded_queue.get()  # remove block from queue (we peeked only)
+
+    def _execute_block(self, block, t_block, proto):
+        "adds the block to the chain, followed by its buffered descendants"
+        pending = [(block, t_block, proto)]
+        while pending:
+            block, t_block, proto = pending.pop()
+            if self.chain.has_blockhash(block.header.hash):
+                log.warn('known block', block=block)
+                continue
+            if not self.chain.has_blockhash(block.header.prevhash):
+                log.debug('missing parent, buffering', block=block, head=self.chain.head)
+                self.block_buffer.add(block, t_block, proto)
+                continue
+
+            # All checks passed
+            log.debug('adding', block=block, ts=time.time())
+            st = time.time()
+            commit_time = getattr(self.app.services.db, 'commit_time', 0.)
+            if self.chain.add_block(block):
+                now = time.time()
+                write = getattr(self.app.services.db, 'commit_time', 0.) - commit_time
+                self._count_stage('execute', 1, now - st - write)
+                self._count_stage('write', 1, write)
+                self._store_header(block.hash, rlp.encode(block.header))
+                if self.chain.head_hash == block.hash:
+                    self.receipts.put(block.hash, self.chain.state.receipts)
+                if block.hash in self.pending_announcements:
+                    self._announce_newblock(*self.pending_announcements.pop(block.hash))
+                log.info('added', block=block, txs=block.transaction_count,
+                         gas_used=block.gas_used)
+                if t_block.newblock_timestamp:
+                    total = now - t_block.newblock_timestamp
+                    self._count_stage('newblock', 1, total)
+                    timings = self.import_timings['newblock']
+                    log.info('processing time', last=total, avg=timings.mean, max=timings.max,
+                             min=timings.min, median=timings.percentile(50))
+                if self.is_mining:
+                    self.txpool.remove_included(block.transactions)
+                children = self.block_buffer.pop_children(block.hash)
+                if children:
+                    log.debug('adding buffered children', block=block, num=len(children))
+                    pending.extend(children)
+                gevent.sleep(0)
+            else:
+                log.warn('could not add', block=block)
+
+    def report_bad_block(self, t_block, errortype):
+        "queues a report of the invalid block, sent in background if an endpoint is configured"
+        if self.bad_block_reporter is not None:
+            self.bad_block_reporter.report(t_block, errortype)
+
+    def _count_stage(self, stage, num_blocks, elapsed):
+        self.import_timings[stage].add(elapsed / num_blocks, num_blocks)
+
+    def import_stats(self):
+        "per stage summaries of the block timings, in seconds, see :attr:`import_stages`"
+        stats = dict()
+        for stage, timings in self.import_timings.items():
+            stats[stage] = timings.summary()
+            stats[stage]['blocks_per_sec'] = timings.count / timings.sum if timings.sum else 0.
+        return stats
+
+    def _recover_queued_senders(self):
+        "recovers the senders of the next queued blocks in the worker processes"
+        blocks = [t_block for t_block, _ in
+                  itertools.islice(self.block_queue.queue, self.sender_recovery_blocks)
+                  if not t_block.senders_recovered]
+        self.sender_recovery.recover([tx for t_block in blocks for tx in t_block.transactions])
+        for t_block in blocks:
+            t_block.senders_recovered = True
+        return len(blocks)
+
     def gpsec(self, gas_spent=0, elapsed=0):
         if gas_spent:
             self.processed_gas += gas_spent
             self.processed_elapsed += elapsed
         return int(old_div(self.processed_gas, (0.001 + self.processed_elapsed)))
 
+    def _peers_knowing(self, known, item_hash, origin=None):
+        "returns the peers whose `known` filter (known_txs or known_blocks) contains the hash"
+        peers = [origin.peer] if origin else []
+        for peer in self.app.services.peermanager.peers:
+            proto = peer.protocols.get(eth_protocol.ETHProtocol)
+            if proto is not None and item_hash in getattr(proto, known):
+                peers.append(peer)
+        return peers
+
     def broadcast_newblock(self, block, chain_difficulty=None, origin=None):
         if not chain_difficulty:
             assert self.chain.has_blockhash(block.hash)
             chain_difficulty = self.chain.get_score(block)
         assert isinstance(block, (eth_protocol.TransientBlock, Block))
-        if self.broadcast_filter.update(block.header.hash):
-            log.debug('broadcasting newblock', origin=origin)
-            bcast = self.app.services.peermanager.broadcast
-            bcast(eth_protocol.ETHProtocol, 'newblock', args=(block, chain_difficulty),
-                  exclude_peers=[origin.peer] if origin else [])
-        else:
+        if not self.broadcast_filter.update(block.header.hash):
             log.debug('already broadcasted block')
+            return
+        received = getattr(block, 'newblock_timestamp', 0) or time.time()
+        peers = self._peers_not_knowing_block(block.header.hash, origin)
+        num_full = self.num_full_propagation(len(peers))
+        log.debug('broadcasting newblock', origin=origin, full=num_full, peers=len(peers))
+        for peer in random.sample(peers, num_full):
+            peer.protocols[eth_protocol.ETHProtocol].send_newblock(block, chain_difficulty)
+            peer.safe_to_read.wait()  # sequential uploads, like peermanager.broadcast
+        self.propagation_stats['full'] += num_full
+        if num_full == len(peers):
+            self.propagation_delay.add(time.time() - received)
+            return
+        # the other peers fetch the block from us, so it is announced once it can be served
+        if self.chain.has_blockhash(block.header.hash):
+            self._announce_newblock(block.header, received)
+        else:
+            self.pending_announcements[block.header.hash] = (block.header, received)
+            if len(self.pending_announcements) > self.max_pending_announcements:
+                self.pending_announcements.popitem(last=False)
+
+    def num_full_propagation(self, num_peers):
+        "the number of peers a new block is sent to, the others only get its hash"
+        if self.block_propagation == 'all' or num_peers < 2:
+            return num_peers
+        return int(math.sqrt(num_peers))
+
+    def _peers_not_knowing_block(self, blockhash, origin=None):
+        exclude = self._peers_knowing('known_blocks', blockhash, origin)
+        return [peer for peer in self.app.services.peermanager.peers
+                if eth_protocol.ETHProtocol in peer.protocols and peer not in exclude]
+
+    def _announce_newblock(self, header, received):
+        "sends newblockhashes to the peers which have not been sent the block"
+        data = eth_protocol.ETHProtocol.newblockhashes.Data(header.hash, header.number)
+        peers = self._peers_not_knowing_block(header.hash)
+        for peer in peers:
+            peer.protocols[eth_protocol.ETHProtocol].send_newblockhashes(data)
+        self.propagation_stats['announced'] += len(peers)
+        self.propagation_delay.add(time.time() - received)
+
+    def propagation_summary(self):
+        "counters of the newblock propagation, delays from receipt of a block to its last send"
+        return dict(self.propagation_stats, delay=self.propagation_delay.summary(),
+                    tx_batch_sizes=self.tx_batch_sizes.summary())
 
     def broadcast_transaction(self, tx, origin=None):
         assert isinstance(tx, Transaction)
-        if self.broadcast_filter.update(tx.hash):
-            log.debug('broadcasting tx', origin=origin)
-            bcast = self.app.services.peermanager.broadcast
-            bcast(eth_protocol.ETHProtocol, 'transactions', args=(tx,),
-                  exclude_peers=[origin.peer] if origin else [])
-        else:
-            log.debug('already broadcasted tx')
+        self.broadcast_transactions([tx], origin=origin)
+
+    def broadcast_transactions(self, transactions, origin=None):
+        """broadcasts those of `transactions` not broadcasted yet, they are buffered per peer
+        and sent in batches, see :meth:`_queue_transactions`"""
+        transactions = [tx for tx in transactions if self.broadcast_filter.update(tx.hash)]
+        if not transactions:
+            log.debug('already broadcasted txs')
+            return
+        log.debug('broadcasting txs', num=len(transactions), origin=origin)
+        for peer in list(self.app.services.peermanager.peers):
+            proto = peer.protocols.get(eth_protocol.ETHProtocol)
+            if proto is None or (origin is not None and peer is origin.peer):
+                continue
+            unknown = [tx for tx in transactions if tx.hash not in proto.known_txs]
+            if unknown:
+                self._queue_transactions(proto, unknown)
+
+    def _queue_transactions(self, proto, transactions):
+        """buffers transactions for the peer, they are sent in one message once
+        `tx_batch_size` are buffered or `tx_batch_interval` seconds after the first one"""
+        if proto not in self.tx_outbox:
+            timer = gevent.spawn_later(self.tx_batch_interval, self._flush_transactions, proto)
+            self.tx_outbox[proto] = ([], timer)
+        outbox, _ = self.tx_outbox[proto]
+        outbox.extend(transactions)
+        if len(outbox) >= self.tx_batch_size:
+            self._flush_transactions(proto)
+
+    def _flush_transactions(self, proto):
+        transactions, timer = self.tx_outbox.pop(proto, (None, None))
+        if transactions is None:
+            return
+        if timer is not gevent.getcurrent():
+            timer.kill(block=False)
+        if proto.is_stopped:
+            return
+        # received from the peer meanwhile
+        transactions = [tx for tx in transactions if tx.hash not in proto.known_txs]
+        for i in range(0, len(transactions), self.tx_batch_size):
+            batch = transactions[i:i + self.tx_batch_size]
+            proto.send_transactions(*batch)
+            self.tx_batch_sizes.add(len(batch))
+            proto.peer.safe_to_read.wait()  # sequential uploads, like peermanager.broadcast
 
     def query_headers(self, hash_mode, max_hashes, skip, reverse, origin_hash=None, number=None):
-        headers = []
-        unknown = False
-        while not unknown and len(headers) < max_hashes:
-            if hash_mode:
-                if not origin_hash:
-                    break
-                block = self.chain.get_block(origin_hash)
-                if not block:
-                    break
-                # If reached genesis, stop
-                if block.number == 0:
-                    break
-                origin = block.header
+        if hash_mode:
+            origin = self.get_headers([origin_hash])[0] if origin_hash else None
+            if origin is None or origin.number == 0:  # If reached genesis, stop
+                return []
+            if self.get_blockhashes_by_number([origin.number])[0] != origin_hash:
+                return self._query_side_chain_headers(origin, max_hashes, skip, reverse)
+            # the ancestors and descendants of a canonical block are found by number
+            number = origin.number
+        return self._query_headers_by_number(max_hashes, skip, reverse, number)
+
+    def _query_headers_by_number(self, max_hashes, skip, reverse, number):
+        # number traversal, the requested headers are independent and fetched in one batch
+        numbers = []
+        while number and len(numbers) < max_hashes:  # If reached genesis, stop
+            numbers.append(number)
+            if reverse:
+                number = number - (skip + 1) if number >= (skip + 1) else None
             else:
-                # If reached genesis, stop
-                if number is None or number == 0:
-                    break
-                block = self.chain.get_block_by_number(number)
-                if block is None:
-                    break
-                origin = block.header
-
-            headers.append(origin)
-
-            if hash_mode:  # hash traversal
-                if reverse:
-                    for i in range(skip+1):
-                        try:
-                            block = self.chain.get_block(origin_hash)
-                            if block:
-                                origin_hash = block.prevhash
-                            else:
-                                unknown = True
-                                break
-                        except KeyError:
-                            unknown = True
-                            break
-                else:
-                    blockhash = self.chain.get_blockhash_by_number(origin.number + skip + 1)
-                    try:
-                        # block = self.chain.get_block(blockhash)
-                        if block and self.chain.get_blockhashes_from_hash(blockhash, skip+1)[skip] == origin_hash:
-                            origin_hash = blockhash
-                        else:
-                            unknown = True
-                    except KeyError:
-                        unknown = True
-            else:  # number traversal
-                if reverse:
-                    if number >= (skip + 1):
-                        number -= (skip + 1)
-                    else:
-                        unknown = True
-                else:
-                    number += (skip + 1)
+                number += (skip + 1)
+
+        headers = []
+        for header in self.get_headers(self.get_blockhashes_by_number(numbers)):
+            if header is None:
+                break
+            headers.append(header)
+        return headers
+
+    def _query_side_chain_headers(self, origin, max_hashes, skip, reverse):
+        # hash traversal from a block off the canonical chain, only its ancestors are known
+        headers = [origin]
+        header = origin
+        while reverse and len(headers) < max_hashes:
+            for _ in range(skip + 1):
+                header = self.get_headers([header.prevhash])[0]
+                if header is None:
+                    return headers
+            if header.number == 0:
+                break
+            headers.append(header)
         return headers
 
+    def get_headers(self, blockhashes):
+        """Batched header lookup, `None` for unknown blocks.
+
+        Headers are stored apart from the blocks under `b'header:'` + block hash. Those of
+        blocks added before are cut from the block RLP, without decoding the body, and stored.
+        """
+        known = [h for h in blockhashes if h is not None]
+        headers_rlp = dict(zip(known, get_many(self.chain.db, [b'header:' + h for h in known])))
+        missing = [h for h in known if headers_rlp[h] is None]
+        for blockhash, block_rlp in zip(missing, get_many(self.chain.db, missing)):
+            if block_rlp is None:
+                continue
+            if block_rlp == b'GENESIS':
+                header_rlp = rlp.encode(self.chain.genesis.header)
+            else:
+                header_rlp = list_items(block_rlp)[0]
+            self._store_header(blockhash, header_rlp)
+            headers_rlp[blockhash] = header_rlp
+        return [rlp.decode(headers_rlp[h], BlockHeader) if h is not None and headers_rlp[h]
+                else None for h in blockhashes]
+
+    def _store_header(self, blockhash, header_rlp):
+        key = b'header:' + blockhash
+        if key not in self.chain.db:  # would raise the refcount of a pruning db
+            self.chain.db.put(key, header_rlp)
+
     # wire protocol receivers ###########
 
     def on_wire_protocol_start(self, proto):
@@ -536,7 +1091,7 @@ class ChainService(WiredService):
             # request chain
             self.synchronizer.receive_status(proto, chain_head_hash, chain_difficulty)
             # send transactions
-            transactions = self.transaction_queue.peek()
+            transactions = self.txpool.pending()
             if transactions:
                 log.debug("sending transactions", remote_id=proto)
                 proto.send_transactions(*transactions)
@@ -552,8 +1107,7 @@ class ChainService(WiredService):
         "receives rlp.decoded serialized"
         log.debug('----------------------------------')
         log.debug('remote_transactions_received', count=len(transactions), remote_id=proto)
-        for tx in transactions:
-            self.add_transaction(tx, origin=proto)
+        self.add_transactions(transactions, origin=proto)
 
     # blockhashes ###########
 
@@ -623,12 +1177,13 @@ class ChainService(WiredService):
     def on_receive_getblockbodies(self, proto, blockhashes):
         log.debug('----------------------------------')
         log.debug("on_receive_getblockbodies", count=len(blockhashes))
+        blockhashes = blockhashes[:self.wire_protocol.max_getblocks_count]
         found = []
-        for bh in blockhashes[:self.wire_protocol.max_getblocks_count]:
-            try:
-                found.append(self.chain.get_block(bh))
-            except KeyError:
+        for bh, block_rlp in zip(blockhashes, self.get_blocks_rlp(blockhashes)):
+            if block_rlp is None:
                 log.debug("unknown block requested", block_hash=encode_hex(bh))
+            else:
+                found.append(block_body(block_rlp))  # served without decoding the block
         if found:
             log.debug("found", count=len(found))
             proto.send_blockbodies(*found)
@@ -0,0 +1,67 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from builtins import object
+
+
+class Histogram(object):
+
+    """
+    Streaming histogram of durations, or other non-negative values, with log-linear buckets,
+    like HdrHistogram.
+
+    Values are recorded in units of `resolution` (seconds for durations). Each power of two
+    is split into `2**(precision_bits - 1)` buckets, so percentiles are accurate to within
+    1/2**(precision_bits - 1) of the value, at O(1) cost per recorded value and with memory
+    logarithmic in the range of values.
+    """
+
+    def __init__(self, resolution=1e-6, precision_bits=3):
+        self.resolution = resolution
+        self.precision_bits = precision_bits
+        self.buckets = dict()  # bucket index: count
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def _index(self, units):
+        exponent = max(units.bit_length() - self.precision_bits, 0)
+        return (exponent << self.precision_bits) + (units >> exponent)
+
+    def _upper(self, index):
+        "end (in units, exclusive) of the bucket `index`"
+        mantissa = index & ((1 << self.precision_bits) - 1)
+        return (mantissa + 1) << (index >> self.precision_bits)
+
+    def add(self, value, count=1):
+        "records `count` durations of `value` seconds"
+        index = self._index(int(value / self.resolution))
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        "returns the duration below which `p` percent of the recorded values fall"
+        if not self.count:
+            return 0.
+        rank = p / 100. * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self._upper(index) * self.resolution, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.
+
+    def summary(self, percentiles=(50, 90, 99)):
+        summary = dict(count=self.count, sum=self.sum, mean=self.mean,
+                       min=self.min or 0., max=self.max or 0.)
+        for p in percentiles:
+            summary['p%d' % p] = self.percentile(p)
+        return summary
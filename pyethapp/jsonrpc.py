@@ -170,7 +170,7 @@ class RPCServer(BaseService):
 
     @classmethod
     def subdispatcher_classes(cls):
-        return (Web3, Personal, Net, Compilers, DB, Chain, Miner, FilterManager)
+        return (Web3, Personal, Net, Compilers, DB, Chain, Miner, FilterManager, TxPool, Debug)
 
     def get_block(self, block_id=None):
         """Return the block identified by `block_id`.
@@ -504,14 +504,15 @@ def tx_encoder(transaction, block, i, pending):
     """Encode a transaction as JSON object.
 
     `transaction` is the `i`th transaction in `block`. `pending` specifies if
-    the block is pending or already mined.
+    the block is pending or already mined. `block` is `None` for transactions in
+    the txpool only.
     """
     return {
         'hash': data_encoder(transaction.hash),
         'nonce': quantity_encoder(transaction.nonce),
-        'blockHash': data_encoder(block.hash),
+        'blockHash': data_encoder(block.hash) if block is not None else None,
         'blockNumber': quantity_encoder(block.number) if not pending else None,
-        'transactionIndex': quantity_encoder(i),
+        'transactionIndex': quantity_encoder(i) if block is not None else None,
         'from': data_encoder(transaction.sender),
         'to': data_encoder(transaction.to),
         'value': quantity_encoder(transaction.value),
@@ -830,6 +831,52 @@ class DB(Subdispatcher):
             return ''
 
 
+class TxPool(Subdispatcher):
+
+    """Subdispatcher for methods to inspect the transaction pool."""
+
+    prefix = 'txpool_'
+    required_services = ['chain']
+
+    @public
+    def status(self):
+        status = self.chain.txpool.status()
+        return {
+            'pending': quantity_encoder(status['pending']),
+            'queued': quantity_encoder(status['queued']),
+        }
+
+    @public
+    def content(self):
+        content = self.chain.txpool.content()
+        return dict((kind, dict(
+            (address_encoder(sender), dict(
+                (str(nonce), tx_encoder(tx, None, None, True)) for nonce, tx in txs.items()))
+            for sender, txs in content[kind].items()))
+            for kind in ('pending', 'queued'))
+
+
+class Debug(Subdispatcher):
+
+    """Subdispatcher for diagnostics of the node."""
+
+    prefix = 'debug_'
+    required_services = ['chain']
+
+    @public
+    def blockProcessingStats(self):
+        """Returns the timings of imported blocks per stage: count, sum, mean, min, max and
+        percentiles, in seconds, and blocks per second of the stage."""
+        return self.chain.import_stats()
+
+    @public
+    def blockPropagationStats(self):
+        """Returns the number of peers sent new blocks in full and announced them by hash,
+        the bytes saved by the announcements, the delay of the propagation, in seconds, and
+        the sizes of the batches of transactions sent to peers."""
+        return self.chain.propagation_summary()
+
+
 class Chain(Subdispatcher):
 
     """Subdispatcher for methods to query the block chain."""
@@ -1358,9 +1405,8 @@ class LogFilter(object):
             if first > last:
                 return {}
 
-        blocks_to_check = []
-        for n in range(first, last):
-            blocks_to_check.append(self.chain.get_block_by_number(n))
+        blocks_to_check = self.chainservice.get_blocks(
+            self.chainservice.get_blockhashes_by_number(range(first, last)))
         # last block may be head candidate, which cannot be retrieved via get_block_by_number
         if last == self.chainservice.head_candidate.number:
             blocks_to_check.append(self.chainservice.head_candidate)
@@ -1676,7 +1722,8 @@ class FilterManager(Subdispatcher):
             return None
         if block not in self.chain.chain:
             return None
-        receipt = self.chain.get_receipts(block)[index]
+        receipts = self.chain.get_receipts(block)
+        receipt = receipts[index]
         response = {
             'transactionHash': data_encoder(tx.hash),
             'transactionIndex': quantity_encoder(index),
@@ -1688,7 +1735,7 @@ class FilterManager(Subdispatcher):
         if index == 0:
             response['gasUsed'] = quantity_encoder(receipt.gas_used)
         else:
-            prev_receipt = temp_state.receipts[index - 1]
+            prev_receipt = receipts[index - 1]
             assert prev_receipt.gas_used < receipt.gas_used
             response['gasUsed'] = quantity_encoder(receipt.gas_used - prev_receipt.gas_used)
 
@@ -8,12 +8,16 @@ import leveldb
 from ethereum import slogging
 from ethereum.utils import encode_hex
 import random
+from .db_cache import ReadCache
+from .db_compression import Compressor, from_config as compressor_from_config
+from .db_io_pool import IOPool
+from .db_write_buffer import WriteBuffer
 
 slogging.set_level('db', 'debug')
 log = slogging.get_logger('db')
 
-compress = decompress = lambda x: x
 PY3 = sys.version_info >= (3,)
+NULL = object()  # marks keys without pending write, None marks pending deletes
 
 
 """
@@ -51,7 +55,7 @@ reading all entries == 400MB
 """
 
 
-class LevelDB(BaseDB):
+class LevelDB(WriteBuffer, BaseDB):
     """
     filename                                    the database directory
     block_cache_size  (default: 8 * (2 << 20))  maximum allowed size for the block cache in bytes
@@ -62,73 +66,152 @@ class LevelDB(BaseDB):
     error_if_exists   (default: False)          if True, raises and error if the database exists
     paranoid_checks   (default: False)          if True, raises an error as soon as an internal
                                                 corruption is detected
+
+    read_cache_bytes  (default: 64 * 2**20)     byte budget of the LRU cache for values read from
+                                                disk, kept separate from the uncommitted writes
+    io_threads        (default: 0)              run disk reads and batch writes on a pool of
+                                                this many threads, 0 runs them on the hub
+    io_queue          (default: 64)             calls allowed to wait for a thread of the pool
+    compressor        (default: None)           :class:`Compressor` applied to all values, None
+                                                reads and writes them uncompressed
+
+    Pending writes are buffered by :class:`WriteBuffer`, see there for the flush and sync options.
     """
 
     max_open_files = 32000
     block_cache_size = 8 * 1024**2
     write_buffer_size = 4 * 1024**2
-
-    def __init__(self, dbfile):
-        self.uncommitted = dict()
+    read_cache_bytes = 64 * 1024**2
+
+    def __init__(self, dbfile, read_cache_bytes=None, io_threads=0, io_queue=64,
+                 compressor=None, block_cache_size=None, write_buffer_size=None,
+                 **write_buffer_options):
+        if block_cache_size is not None:
+            self.block_cache_size = block_cache_size
+        if write_buffer_size is not None:
+            self.write_buffer_size = write_buffer_size
+        io_pool = IOPool(io_threads, io_queue) if io_threads else None
+        self.init_write_buffer(io_pool=io_pool, **write_buffer_options)
+        if read_cache_bytes is None:
+            read_cache_bytes = self.read_cache_bytes
+        self.read_cache = ReadCache(read_cache_bytes)
+        self.compressor = compressor or Compressor(level=0)
         log.info('opening LevelDB',
                  path=dbfile,
                  block_cache_size=self.block_cache_size,
                  write_buffer_size=self.write_buffer_size,
-                 max_open_files=self.max_open_files)
+                 max_open_files=self.max_open_files,
+                 read_cache_bytes=read_cache_bytes,
+                 io_threads=io_threads,
+                 compressor=self.compressor,
+                 **write_buffer_options)
         self.dbfile = dbfile
-        self.db = leveldb.LevelDB(dbfile, max_open_files=self.max_open_files)
-        self.commit_counter = 0
+        self.db = self._open()
+
+    def _open(self):
+        return leveldb.LevelDB(self.dbfile, max_open_files=self.max_open_files,
+                               block_cache_size=self.block_cache_size,
+                               write_buffer_size=self.write_buffer_size)
 
     def reopen(self):
+        self.wait_flushed()
         del self.db
-        self.db = leveldb.LevelDB(self.dbfile)
+        self.db = self._open()
+
+    def _read(self, func, *args):
+        if self.io_pool is None:
+            return func(*args)
+        return self.io_pool.run('read', func, *args)
+
+    @staticmethod
+    def _db_key(key):
+        if PY3 and isinstance(key, str):
+            return key.encode()
+        return key
 
     def get(self, key):
         log.trace('getting entry', key=encode_hex(key)[:8])
-        if key in self.uncommitted:
-            if self.uncommitted[key] is None:
+        o = self._buffered(key, NULL)
+        if o is not NULL:
+            if o is None:
                 raise KeyError("key not in db")
             log.trace('from uncommitted')
-            return self.uncommitted[key]
+            return o
+
+        key = self._db_key(key)
+        o = self.read_cache.get(key)
+        if o is not None:
+            log.trace('from read cache')
+            return o
         log.trace('from db')
 
-        if PY3:
-            if isinstance(key, str):
-                key = key.encode()
-            o = bytes(self.db.Get(key))
-        else:
-            o = decompress(self.db.Get(key))
-        self.uncommitted[key] = o
+        o = self.compressor.decompress(bytes(self._read(self.db.Get, key)))
+        self.read_cache.put(key, o)
         return o
 
+    def get_many(self, keys):
+        """Return the values for `keys` in the same order, `None` for missing keys.
+
+        Keys that are neither pending nor cached are read from disk in ascending order.
+        """
+        values = [None] * len(keys)
+        lookup = dict()  # db key: positions in keys
+        for i, key in enumerate(keys):
+            o = self._buffered(key, NULL)
+            if o is NULL:
+                key = self._db_key(key)
+                o = self.read_cache.get(key)
+                if o is None:
+                    lookup.setdefault(key, []).append(i)
+                    continue
+            values[i] = o
+
+        for key, o in self._read(self._get_sorted, lookup):
+            self.read_cache.put(key, o)
+            for i in lookup[key]:
+                values[i] = o
+
+        return values
+
+    def _get_sorted(self, keys):
+        "reads `keys` from disk in ascending order, returns the pairs found"
+        found = []
+        for key in sorted(keys):
+            try:
+                o = self.db.Get(key)
+            except KeyError:
+                continue
+            found.append((key, self.compressor.decompress(bytes(o))))
+        return found
+
+    def contains_many(self, keys):
+        return [o is not None for o in self.get_many(keys)]
+
     def put(self, key, value):
         log.trace('putting entry', key=encode_hex(key)[:8], len=len(value))
-        self.uncommitted[key] = value
+        self.read_cache.invalidate(self._db_key(key))
+        self._buffer_write(key, value, len(key) + len(value))
 
-    def commit(self):
-        log.debug('committing', db=self)
+    def _write_batch(self, items, sync):
         batch = leveldb.WriteBatch()
-        for k, v in list(self.uncommitted.items()):
+        for k, v in list(items.items()):
             if v is None:
-                batch.Delete(k)
+                batch.Delete(self._db_key(k))
             else:
-                compress_v = compress(v)
-                if PY3:
-                    if isinstance(k, str):
-                        k = k.encode()
-                    if isinstance(compress_v, str):
-                        compress_v = compress_v.encode()
-                batch.Put(k, compress_v)
-        self.db.Write(batch, sync=False)
-        self.uncommitted.clear()
-        log.debug('committed', db=self, num=len(self.uncommitted))
-        # self.commit_counter += 1
-        # if self.commit_counter % 100 == 0:
-        #     self.reopen()
+                if PY3 and isinstance(v, str):
+                    v = v.encode()
+                batch.Put(self._db_key(k), self.compressor.compress(v))
+        self.db.Write(batch, sync=sync)
 
     def delete(self, key):
         log.trace('deleting entry', key=key)
-        self.uncommitted[key] = None
+        self.read_cache.invalidate(self._db_key(key))
+        self._buffer_write(key, None, len(key))
+
+    def iter_keys(self):
+        "iterates over all keys on disk"
+        for key in self.db.RangeIter(include_value=False):
+            yield bytes(key)
 
     def _has_key(self, key):
         try:
@@ -147,7 +230,8 @@ class LevelDB(BaseDB):
         return isinstance(other, self.__class__) and self.db == other.db
 
     def __repr__(self):
-        return '<DB at %d uncommitted=%d>' % (id(self.db), len(self.uncommitted))
+        return '<DB at %d uncommitted=%d cached=%d>' % (id(self.db), len(self.uncommitted),
+                                                        len(self.read_cache))
 
     def inc_refcount(self, key, value):
         self.put(key, value)
@@ -179,10 +263,20 @@ class LevelDBService(LevelDB, BaseService):
     def __init__(self, app):
         BaseService.__init__(self, app)
         assert self.app.config['data_dir']
-        self.uncommitted = dict()
         self.stop_event = Event()
         dbfile = os.path.join(self.app.config['data_dir'], 'leveldb')
-        LevelDB.__init__(self, dbfile)
+        dbconfig = self.app.config.get('db', {})
+        LevelDB.__init__(self, dbfile,
+                         read_cache_bytes=dbconfig.get('read_cache_bytes'),
+                         flush_keys=dbconfig.get('flush_keys', 0),
+                         flush_bytes=dbconfig.get('flush_bytes', 0),
+                         background_flush=dbconfig.get('background_flush', False),
+                         sync_every=dbconfig.get('sync_every') or 0,
+                         io_threads=dbconfig.get('io_threads', 0),
+                         io_queue=dbconfig.get('io_queue', 64),
+                         compressor=compressor_from_config(dbconfig),
+                         block_cache_size=dbconfig.get('block_cache_size'),
+                         write_buffer_size=dbconfig.get('write_buffer_size'))
         self.h = random.randrange(10**50)
 
     def _run(self):
@@ -191,6 +285,9 @@ class LevelDBService(LevelDB, BaseService):
     def stop(self):
         self.stop_event.set()
         # commit?
+        self.wait_flushed()
+        if self.io_pool is not None:
+            self.io_pool.kill()
         log.debug('closing db')
 
     def __hash__(self):
@@ -7,6 +7,10 @@ from ethereum.db import BaseDB
 from ethereum.slogging import get_logger
 from gevent.event import Event
 
+from .db_compression import from_config as compressor_from_config
+from .db_io_pool import IOPool
+from .db_write_buffer import WriteBuffer
+
 log = get_logger('db')
 
 # unique objects to represent state in the transient store, the delete
@@ -17,8 +21,29 @@ DELETE = object()
 TB = (2 ** 10) ** 4
 
 
-class LmDBService(BaseDB, BaseService):
-    """A service providing an interface to a lmdb."""
+def _cursor_lookup(transaction, keys):
+    found = dict()
+    cursor = transaction.cursor()
+    for key in sorted(keys):
+        if cursor.set_key(key):
+            found[key] = cursor.value()
+    return found
+
+
+class LmDBService(WriteBuffer, BaseDB, BaseService):
+    """A service providing an interface to a lmdb.
+
+    Pending writes are buffered by :class:`WriteBuffer`. Unless `db.sync_every` is set to
+    something else than 1, every write transaction is synced to disk. Otherwise the
+    environment is opened without syncing, durability is then controlled by `db.sync_every`.
+
+    Reads share one long-lived read-only transaction, which is renewed once a write
+    transaction has been committed, i.e. whenever the head may have changed. With
+    `db.io_threads` reads and writes run on an :class:`IOPool` instead, each read in a
+    transaction of its own, as a transaction must not be used by several threads at once.
+
+    Values are compressed as configured by the `db.compression_*` options.
+    """
 
     name = 'db'
     default_config = dict()  # the defaults are defined in pyethapp.db_service
@@ -30,9 +55,23 @@ class LmDBService(BaseDB, BaseService):
 
         db_directory = os.path.join(app.config['data_dir'], 'lmdb')
 
-        self.env = lmdb.Environment(db_directory, map_size=TB)
+        dbconfig = app.config.get('db', {})
+        sync_every = dbconfig.get('sync_every')
+        if sync_every is None:
+            sync_every = 1
+        self.env_sync = sync_every == 1
+        self.env = lmdb.Environment(db_directory, map_size=TB, sync=self.env_sync)
         self.db_directory = db_directory
-        self.uncommitted = dict()
+        io_threads = dbconfig.get('io_threads', 0)
+        self.init_write_buffer(
+            io_pool=IOPool(io_threads, dbconfig.get('io_queue', 64)) if io_threads else None,
+            flush_keys=dbconfig.get('flush_keys', 0),
+            flush_bytes=dbconfig.get('flush_bytes', 0),
+            background_flush=dbconfig.get('background_flush', False),
+            sync_every=sync_every)
+        self.compressor = compressor_from_config(dbconfig)
+        self._read_txn = None
+        self._read_txn_stale = False
         self.stop_event = Event()
 
     def _run(self):
@@ -40,12 +79,16 @@ class LmDBService(BaseDB, BaseService):
 
     def stop(self):
         self.stop_event.set()
+        self.wait_flushed()
+        self._close_read_transaction()
+        if self.io_pool is not None:
+            self.io_pool.kill()
 
     def put(self, key, value):
-        self.uncommitted[key] = value
+        self._buffer_write(key, value, len(key) + len(value))
 
     def delete(self, key):
-        self.uncommitted[key] = DELETE
+        self._buffer_write(key, DELETE, len(key))
 
     def inc_refcount(self, key, value):
         self.put(key, value)
@@ -58,38 +101,94 @@ class LmDBService(BaseDB, BaseService):
         self.dec_refcount(key)
 
     def reopen(self):
+        self.wait_flushed()
+        self._close_read_transaction()
         self.env.close()
         del self.env
         # the map_size is stored in the database itself after it's first created
-        self.env = lmdb.Environment(self.db_directory)
+        self.env = lmdb.Environment(self.db_directory, sync=self.env_sync)
 
     def get(self, key):
-        value = self.uncommitted.get(key, NULL)
+        value = self._buffered(key, NULL)
 
         if value is DELETE:
             raise KeyError('key not in db')
 
         if value is NULL:
-            with self.env.begin(write=False) as transaction:
-                value = transaction.get(key, NULL)
+            if self.io_pool is None:
+                value = self._read_transaction().get(key, NULL)
+            else:
+                value = self._lookup([key]).get(key, NULL)
 
             if value is NULL:
                 raise KeyError('key not in db')
-
-            self.uncommitted[key] = value
+            value = self.compressor.decompress(value)
 
         return value
 
-    def commit(self):
+    def get_many(self, keys):
+        """Return the values for `keys` in the same order, `None` for missing keys.
+
+        Keys without pending write are looked up in ascending order using a single cursor.
+        """
+        found = dict()
+        lookup = set()
+        for key in keys:
+            value = self._buffered(key, NULL)
+            if value is NULL:
+                lookup.add(key)
+            elif value is not DELETE:
+                found[key] = value
+
+        if lookup:
+            decompress = self.compressor.decompress
+            for key, value in self._lookup(lookup).items():
+                found[key] = decompress(value)
+
+        return [found.get(key) for key in keys]
+
+    def _lookup(self, keys):
+        "returns a dict of the `keys` found on disk, read in ascending order"
+        if self.io_pool is None:
+            return _cursor_lookup(self._read_transaction(), keys)
+        return self.io_pool.run('read', self._lookup_in_transaction, keys)
+
+    def _lookup_in_transaction(self, keys):
+        with self.env.begin(write=False) as transaction:
+            return _cursor_lookup(transaction, keys)
+
+    def contains_many(self, keys):
+        return [value is not None for value in self.get_many(keys)]
+
+    def iter_keys(self):
+        "iterates over all keys on disk"
+        with self.env.begin(write=False) as transaction:
+            for key in transaction.cursor().iternext(values=False):
+                yield key
+
+    def _read_transaction(self):
+        if self._read_txn_stale:  # reopened to see the latest write
+            self._close_read_transaction()
+        if self._read_txn is None:
+            self._read_txn = self.env.begin(write=False)
+        self._read_txn_stale = False
+        return self._read_txn
+
+    def _close_read_transaction(self):
+        if self._read_txn is not None:
+            self._read_txn.abort()
+            self._read_txn = None
+
+    def _write_batch(self, items, sync):
         keys_to_delete = (
             key
-            for key, value in list(self.uncommitted.items())
+            for key, value in list(items.items())
             if value is DELETE
         )
 
         items_to_insert = (
-            (key, value)
-            for key, value in list(self.uncommitted.items())
+            (key, self.compressor.compress(value))
+            for key, value in list(items.items())
             if value not in (DELETE, NULL)  # NULL shouldn't happen
         )
 
@@ -100,6 +199,11 @@ class LmDBService(BaseDB, BaseService):
             cursor = transaction.cursor()
             cursor.putmulti(items_to_insert, overwrite=True)
 
+        if sync and not self.env_sync:
+            self.env.sync(True)
+        # the read transaction still sees the snapshot from before this write
+        self._read_txn_stale = True
+
     def revert_refcount_changes(self, epoch):
         pass
 
@@ -117,7 +221,7 @@ class LmDBService(BaseDB, BaseService):
         return True
 
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and self.db == other.db
+        return isinstance(other, self.__class__) and self.env == other.env
 
     def __repr__(self):
         return '<DB at %d uncommitted=%d>' % (id(self.env), len(self.uncommitted))
@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+from collections import OrderedDict
+
+import rlp
+from rlp.sedes import CountableList
+from ethereum.messages import Receipt
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.receipts')
+
+PREFIX = b'receipts:'  # followed by the block hash
+receipts_sedes = CountableList(Receipt)
+
+
+class ReceiptsStore(object):
+
+    """
+    Receipts of imported blocks, stored as one RLP list per block under `b'receipts:'` + block
+    hash. The most recently used lists are kept decoded in an LRU of `cache_size` blocks.
+
+    Receipts of a block never change, so neither the database entries nor the cached lists
+    have to be invalidated on reorgs.
+    """
+
+    def __init__(self, db, cache_size=256):
+        self.db = db
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # block hash: list of receipts
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, blockhash, receipts):
+        self.cache[blockhash] = receipts
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, blockhash):
+        "returns the receipts of the block, `None` if they have not been stored"
+        try:
+            receipts = self.cache.pop(blockhash)
+        except KeyError:
+            pass
+        else:
+            self.cache[blockhash] = receipts
+            self.hits += 1
+            return receipts
+        self.misses += 1
+        try:
+            data = self.db.get(PREFIX + blockhash)
+        except KeyError:
+            return None
+        receipts = rlp.decode(data, receipts_sedes)
+        self._remember(blockhash, receipts)
+        return receipts
+
+    def put(self, blockhash, receipts):
+        receipts = list(receipts)
+        if PREFIX + blockhash not in self.db:  # would raise the refcount of a pruning db
+            self.db.put(PREFIX + blockhash, rlp.encode(receipts, receipts_sedes))
+        self._remember(blockhash, receipts)
+
+    def __contains__(self, blockhash):
+        return blockhash in self.cache or PREFIX + blockhash in self.db
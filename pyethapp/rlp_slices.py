@@ -0,0 +1,69 @@
+# -*- coding: utf8 -*-
+"""Access to the items of RLP encoded lists, without decoding them."""
+from __future__ import absolute_import
+import struct
+
+import rlp
+from ethereum.utils import big_endian_to_int, int_to_big_endian
+
+
+def item_bounds(data, pos=0):
+    """Returns the (start of the payload, end) of the RLP item starting at `pos`.
+
+    Only the length prefix is read, the payload is not checked.
+    """
+    if pos >= len(data):
+        raise rlp.DecodingError('RLP item out of bounds', data)
+    prefix = ord(data[pos:pos + 1])
+    if prefix < 0x80:  # single byte
+        return pos, pos + 1
+    if prefix < 0xb8:  # short string
+        return pos + 1, pos + 1 + prefix - 0x80
+    if prefix < 0xc0:  # long string
+        length_size = prefix - 0xb7
+        length = big_endian_to_int(data[pos + 1:pos + 1 + length_size])
+        return pos + 1 + length_size, pos + 1 + length_size + length
+    if prefix < 0xf8:  # short list
+        return pos + 1, pos + 1 + prefix - 0xc0
+    length_size = prefix - 0xf7  # long list
+    length = big_endian_to_int(data[pos + 1:pos + 1 + length_size])
+    return pos + 1 + length_size, pos + 1 + length_size + length
+
+
+def list_items(data):
+    "returns the encoded items of the RLP list `data`, as slices of it"
+    if not data or ord(data[0:1]) < 0xc0:
+        raise rlp.DecodingError('RLP list expected', data)
+    pos, end = item_bounds(data)
+    if end != len(data):
+        raise rlp.DecodingError('RLP list length mismatch', data)
+    items = []
+    while pos < end:
+        _, item_end = item_bounds(data, pos)
+        if item_end > end:
+            raise rlp.DecodingError('RLP item exceeds its list', data)
+        items.append(data[pos:item_end])
+        pos = item_end
+    return items
+
+
+def list_prefix(length):
+    "returns the RLP prefix of a list with a payload of `length` bytes"
+    if length < 56:
+        return struct.pack('B', 0xc0 + length)
+    length_bytes = int_to_big_endian(length)
+    return struct.pack('B', 0xf7 + len(length_bytes)) + length_bytes
+
+
+def encode_list(items):
+    "returns the RLP list of the already encoded `items`"
+    payload = b''.join(items)
+    return list_prefix(len(payload)) + payload
+
+
+def block_body(block_rlp):
+    "returns the RLP of the body, [transactions, uncles], of the RLP encoded block"
+    items = list_items(block_rlp)
+    if len(items) != 3:
+        raise rlp.DecodingError('RLP block expected', block_rlp)
+    return encode_list(items[1:])
@@ -0,0 +1,89 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+from builtins import object
+
+import gevent
+import gevent.lock
+import gipc
+import rlp
+from ethereum.exceptions import InvalidTransaction
+from ethereum.slogging import get_logger
+from ethereum.transactions import Transaction
+
+log = get_logger('eth.senders')
+
+
+def recover_senders(transactions_rlp):
+    "returns the senders of the RLP encoded transactions, `None` for invalid signatures"
+    senders = []
+    for tx_rlp in transactions_rlp:
+        try:
+            senders.append(rlp.decode(tx_rlp, Transaction).sender)
+        except (InvalidTransaction, rlp.RLPException, AssertionError):
+            senders.append(None)
+    return senders
+
+
+def recovery_worker_process(cpipe):
+    "entry point of the worker processes, answers lists of RLP encoded transactions"
+    gevent.get_hub().SYSTEM_ERROR = BaseException  # stop on any exception
+    while True:
+        cpipe.put(recover_senders(cpipe.get()))
+
+
+class SenderRecoveryPool(object):
+
+    """
+    Recovers the senders of transactions in worker processes.
+
+    The ECDSA recovery dominates the CPU time of block import. Transactions of a batch are
+    split across the workers and their senders are attached to the `Transaction` objects,
+    which then skip the recovery when the blocks are executed. Transactions with an invalid
+    signature are left alone, their execution raises as before.
+
+    Only the calling greenlet waits for the workers. Batches smaller than `min_batch` are
+    left to the lazy recovery on execution, as the inter-process overhead would dominate.
+    """
+
+    min_batch = 64
+
+    def __init__(self, num_processes):
+        self.lock = gevent.lock.Semaphore()
+        self.workers = []
+        for _ in range(num_processes):
+            cpipe, ppipe = gipc.pipe(duplex=True)
+            process = gipc.start_process(target=recovery_worker_process, args=(cpipe,))
+            self.workers.append((process, ppipe))
+        self.recovered = 0
+
+    def recover(self, transactions):
+        "attaches the senders to those of `transactions` which have not been recovered yet"
+        transactions = [tx for tx in transactions if tx._sender is None]
+        if len(transactions) < self.min_batch:
+            return 0
+        chunk_size = -(-len(transactions) // len(self.workers))
+        chunks = [transactions[i:i + chunk_size]
+                  for i in range(0, len(transactions), chunk_size)]
+        # in a greenlet of its own, so that killing the caller can not leave unread replies
+        # in the pipes, which would be attached to the transactions of the next batch
+        gevent.spawn(self._exchange, chunks).get()
+        self.recovered += len(transactions)
+        log.debug('recovered senders', num=len(transactions), workers=len(chunks))
+        return len(transactions)
+
+    def _exchange(self, chunks):
+        with self.lock:  # the pipes carry one batch at a time
+            for chunk, (_, ppipe) in zip(chunks, self.workers):
+                ppipe.put([rlp.encode(tx) for tx in chunk])
+            for chunk, (_, ppipe) in zip(chunks, self.workers):
+                for tx, sender in zip(chunk, ppipe.get()):
+                    if sender is not None:
+                        tx.sender = sender
+
+    def stop(self):
+        for process, ppipe in self.workers:
+            process.terminate()
+            process.join()
+        self.workers = []
@@ -1,21 +1,36 @@
+from __future__ import absolute_import
 from future import standard_library
 standard_library.install_aliases()
 from builtins import str
+from builtins import object
+import json
+import os
+import random
+import time
+
+import gevent
+import gevent.queue
+import rlp
 from ethereum import utils
-import random, rlp, sys
+from ethereum.slogging import get_logger
 try:
-    from urllib.request import build_opener
+    from urllib.error import HTTPError
+    from urllib.request import build_opener, Request
 except:
-    from urllib2 import build_opener
+    from urllib2 import build_opener, HTTPError, Request
+
+log = get_logger('eth.badblocks')
+
+DEFAULT_ENDPOINT = 'http://badblocks.ethereum.org'
 
 
 # Makes a request to a given URL (first arg) and optional params (second arg)
-def make_request(*args):
+def make_request(*args, **kwargs):
     opener = build_opener()
     opener.addheaders = [('User-agent',
                           'Mozilla/5.0'+str(random.randrange(1000000)))]
     try:
-        return opener.open(*args).read().strip()
+        return opener.open(*args, **kwargs).read().strip()
     except Exception as e:
         try:
             p = e.read().strip()
@@ -24,16 +39,124 @@ def make_request(*args):
         raise Exception(p)
 
 
-def warn_invalid(block, errortype='other'):
-    try:
-        make_request('http://badblocks.ethereum.org', {
-            "block": utils.encode_hex(rlp.encode(block)),
-            "errortype": errortype,
-            "hints": {
-                "receipts": [utils.encode_hex(rlp.encode(x)) for x in
-                             block.get_receipts()],
-                "vmtrace": "NOT YET IMPLEMENTED"
-            }
-        })
-    except:
-        sys.stderr.write('Failed to connect to badblocks.ethdev.com\n')
+def post_report(endpoint, report, timeout=10.):
+    "posts `report` as JSON object, raises `HTTPError` if the endpoint rejects it"
+    request = Request(endpoint, json.dumps(report).encode('utf-8'),
+                      {'Content-Type': 'application/json'})
+    return build_opener().open(request, timeout=timeout).read().strip()
+
+
+class BadBlockReporter(object):
+
+    """
+    Reports invalid blocks to `endpoint` without blocking the caller.
+
+    :meth:`report` only queues the block; at most `max_queued` reports wait in the queue,
+    further ones are dropped. A greenlet writes the queued reports to `spool_dir` (if given,
+    reports spooled before a restart are sent too) and posts them one by one on the
+    threadpool. Failed posts are retried with exponential backoff. A report is dropped if the
+    endpoint rejects it (4xx) or after `max_attempts` failed posts, at most `max_spooled`
+    reports are kept, the oldest are dropped first.
+    """
+
+    def __init__(self, endpoint=DEFAULT_ENDPOINT, spool_dir=None, max_queued=64,
+                 max_spooled=1024, max_attempts=10, timeout=10., min_backoff=1.,
+                 max_backoff=600.):
+        self.endpoint = endpoint
+        self.spool_dir = spool_dir
+        self.max_spooled = max_spooled
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.queue = gevent.queue.Queue(max_queued)
+        self.spooled = []  # (path or None, report), oldest first
+        self.stats = dict(queued=0, dropped=0, sent=0, failures=0)
+        self.greenlet = None
+        self.counter = 0
+        if spool_dir:
+            if not os.path.exists(spool_dir):
+                os.makedirs(spool_dir)
+            for name in sorted(os.listdir(spool_dir)):
+                path = os.path.join(spool_dir, name)
+                try:
+                    with open(path) as f:
+                        self.spooled.append((path, json.load(f)))
+                except ValueError:
+                    log.warn('dropping corrupt bad block report', path=path)
+                    os.remove(path)
+
+    def start(self):
+        self.greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+
+    def report(self, block, errortype='other'):
+        "queues a report of the invalid `block` (a Block or TransientBlock)"
+        report = dict(block=utils.encode_hex(rlp.encode(block)), errortype=errortype)
+        try:
+            self.queue.put_nowait(report)
+            self.stats['queued'] += 1
+        except gevent.queue.Full:
+            log.debug('too many bad block reports queued, dropping', errortype=errortype)
+            self.stats['dropped'] += 1
+
+    def _spool(self, report):
+        path = None
+        if self.spool_dir:
+            path = os.path.join(self.spool_dir, '%d-%06d.json' % (time.time() * 1000,
+                                                                  self.counter % 10**6))
+            with open(path, 'w') as f:
+                json.dump(report, f)
+        self.counter += 1
+        self.spooled.append((path, report))
+        while len(self.spooled) > self.max_spooled:
+            self._remove_spooled(1)
+            self.stats['dropped'] += 1
+
+    def _remove_spooled(self, num):
+        for path, _ in self.spooled[:num]:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        del self.spooled[:num]
+
+    def _spool_queued(self):
+        "spools the queued reports, waits for one if none are spooled"
+        if not self.spooled:
+            self._spool(self.queue.get())
+        while not self.queue.empty():
+            self._spool(self.queue.get_nowait())
+
+    def _run(self):
+        backoff = self.min_backoff
+        attempts = 0
+        while True:
+            self._spool_queued()
+            report = self.spooled[0][1]
+            pool = gevent.get_hub().threadpool
+            try:
+                pool.apply(post_report, (self.endpoint, report, self.timeout))
+            except Exception as e:
+                self.stats['failures'] += 1
+                attempts += 1
+                rejected = isinstance(e, HTTPError) and 400 <= e.code < 500
+                if rejected or attempts >= self.max_attempts:
+                    log.warn('dropping bad block report', endpoint=self.endpoint, error=e,
+                             attempts=attempts)
+                    self._remove_spooled(1)
+                    self.stats['dropped'] += 1
+                    attempts = 0
+                    continue
+                log.warn('reporting bad block failed', endpoint=self.endpoint, error=e,
+                         retry_in=backoff)
+                gevent.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            log.debug('reported bad block', endpoint=self.endpoint)
+            self._remove_spooled(1)
+            self.stats['sent'] += 1
+            backoff = self.min_backoff
+            attempts = 0
@@ -0,0 +1,19 @@
+from pyethapp.bench import block_queue, db as bench
+
+
+def test_run_ephemdb():
+    lines = []
+    items = bench.synthetic_items(100)
+    assert items == bench.synthetic_items(100)  # reproducible
+    rows = bench.run(items, 100, ['EphemDB'], out=lines.append)
+    assert rows[0][0] == 'EphemDB'
+    assert set(rows[0][1]) == set(['put/s', 'commit ms', 'stall ms', 'get/s',
+                                   'get_many/s', 'miss/s', 'rss MB'])
+    assert len(lines) == 2
+
+
+def test_run_block_queue():
+    lines = []
+    rate, per_announcement = block_queue.run(2, out=lines.append)
+    assert rate > 0
+    assert len(lines) == 2
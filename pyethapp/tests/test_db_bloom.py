@@ -0,0 +1,46 @@
+import os
+from builtins import range
+from pyethapp.db_bloom import BloomFilter
+
+
+def test_no_false_negatives():
+    bf = BloomFilter(1000, 0.01)
+    keys = [os.urandom(32) for _ in range(1000)]
+    for key in keys:
+        bf.add(key)
+    assert all(key in bf for key in keys)
+
+
+def test_false_positive_rate():
+    bf = BloomFilter(1000, 0.01)
+    for _ in range(1000):
+        bf.add(os.urandom(32))
+    false_positives = sum(os.urandom(32) in bf for _ in range(10000))
+    assert false_positives < 300
+    assert bf.negatives == bf.queries - false_positives
+
+
+def test_str_and_bytes_keys():
+    bf = BloomFilter(10)
+    bf.add('network_id')
+    assert b'network_id' in bf
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('bloom'))
+    bf = BloomFilter(100)
+    bf.add(b'a')
+    bf.save(path)
+    loaded = BloomFilter.load(path)
+    assert b'a' in loaded
+    assert loaded.num_bits == bf.num_bits
+    assert loaded.num_hashes == bf.num_hashes
+    assert loaded.count == 1
+
+
+def test_load_invalid(tmpdir):
+    path = str(tmpdir.join('bloom'))
+    assert BloomFilter.load(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'garbage')
+    assert BloomFilter.load(path) is None
@@ -0,0 +1,48 @@
+from pyethapp.db_cache import ReadCache
+
+
+def test_hit_miss():
+    cache = ReadCache(100)
+    assert cache.get(b'a') is None
+    cache.put(b'a', b'x' * 10)
+    assert cache.get(b'a') == b'x' * 10
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.size == 10
+
+
+def test_eviction_by_bytes():
+    cache = ReadCache(30)
+    for k in (b'a', b'b', b'c'):
+        cache.put(k, b'x' * 10)
+    assert cache.size == 30
+    cache.get(b'a')  # a is now most recently used
+    cache.put(b'd', b'x' * 10)
+    assert b'b' not in cache
+    assert b'a' in cache and b'c' in cache and b'd' in cache
+    assert cache.evictions == 1
+    assert cache.size == 30
+
+
+def test_oversized_value_not_cached():
+    cache = ReadCache(10)
+    cache.put(b'a', b'x' * 5)
+    cache.put(b'a', b'x' * 11)
+    assert b'a' not in cache
+    assert cache.size == 0
+
+
+def test_invalidate():
+    cache = ReadCache(100)
+    cache.put(b'a', b'x' * 10)
+    cache.invalidate(b'a')
+    cache.invalidate(b'b')
+    assert b'a' not in cache
+    assert cache.size == 0
+
+
+def test_disabled():
+    cache = ReadCache(0)
+    cache.put(b'a', b'x')
+    assert len(cache) == 0
+    assert cache.get(b'a') is None
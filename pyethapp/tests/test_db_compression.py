@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from pyethapp.db_compression import Compressor, train_dictionary, _supports_zdict
+
+node = b'\xf8\x71' + b'\xa0' + os.urandom(32) + b'\x80' * 14 + b'\xa0' + os.urandom(32) * 2
+
+
+def test_roundtrip():
+    c = Compressor(level=6)
+    stored = c.compress(node)
+    assert len(stored) < len(node)
+    assert stored[:2] == b'\xff\x01'
+    assert c.decompress(stored) == node
+    assert c.stats()['ratio'] < 1
+
+
+def test_raw_values():
+    c = Compressor(level=6)
+    small = b'\xc2\x01\x02'
+    assert c.compress(small) == small
+    incompressible = os.urandom(100).lstrip(b'\xff')
+    assert c.compress(incompressible) == incompressible
+    # values starting with the marker are never stored raw
+    marked = b'\xff' + os.urandom(40)
+    assert c.decompress(c.compress(marked)) == marked
+
+
+def test_old_values_readable():
+    # stored before compression was enabled, e.g. a block hash starting with the marker
+    old = b'\xff\x01\x00' + os.urandom(29)  # not a zlib header
+    assert Compressor(level=6).decompress(old) == old
+    old = b'\xff\x02\x78\x9c' + os.urandom(28)  # zlib header without dictionary
+    assert Compressor(level=6).decompress(old) == old
+    assert Compressor(level=0).decompress(node) == node
+
+
+def test_disabled_reads_compressed():
+    stored = Compressor(level=6).compress(node)
+    c = Compressor(level=0)
+    assert c.compress(node) == node
+    assert c.decompress(stored) == node
+
+
+@pytest.mark.skipif(not _supports_zdict(), reason='zlib without preset dictionaries')
+def test_dictionary():
+    zdict = train_dictionary([node] * 10)
+    c = Compressor(level=6, zdict=zdict)
+    stored = c.compress(node)
+    assert stored[:2] == b'\xff\x02'
+    assert len(stored) < len(Compressor(level=6).compress(node))
+    assert c.decompress(stored) == node
+
+
+@pytest.mark.skipif(not _supports_zdict(), reason='zlib without preset dictionaries')
+def test_dictionary_missing_or_truncated():
+    zdict = train_dictionary([node] * 10)
+    stored = Compressor(level=6, zdict=zdict).compress(node)
+    with pytest.raises(ValueError) as e:
+        Compressor(level=6).decompress(stored)
+    assert 'set db.compression_dict' in str(e.value)
+    with pytest.raises(ValueError) as e:
+        Compressor(level=6, zdict=zdict[1:]).decompress(stored)
+    assert 'different dictionary' in str(e.value)
+    with pytest.raises(ValueError) as e:
+        Compressor(level=6, zdict=zdict).decompress(stored[:-8])
+    assert 'truncated' in str(e.value)
+
+
+def test_truncated():
+    stored = Compressor(level=6).compress(node)
+    with pytest.raises(ValueError):
+        Compressor(level=6).decompress(stored[:-8])
@@ -0,0 +1,128 @@
+import pytest
+import rlp
+from devp2p.app import BaseApp
+from ethereum.utils import int_to_big_endian, sha3
+from pyethapp import db_service
+from pyethapp.db_freezer import Freezer
+
+
+def test_append_get(tmpdir):
+    freezer = Freezer(str(tmpdir), segment_blocks=3)
+    for number in range(1, 8):
+        freezer.append(number, b'block%d' % number)
+    assert freezer.get(1) is None  # not flushed yet
+    freezer.flush()
+    assert freezer.get(1) == b'block1'
+    assert freezer.get(7) == b'block7'
+    assert freezer.get(8) is None
+    assert len(tmpdir.listdir()) == 4  # index and three segments
+    freezer.close()
+
+    freezer = Freezer(str(tmpdir), segment_blocks=3)
+    assert freezer.next_number == 8
+    assert freezer.get(5) == b'block5'
+
+
+def test_recover_unindexed(tmpdir):
+    freezer = Freezer(str(tmpdir), segment_blocks=10)
+    freezer.append(0, b'a')
+    freezer.flush()
+    freezer.append(1, b'b')
+    freezer.index.truncate(freezer.header.size + freezer.entry.size)  # index entry lost
+    freezer.segments[0].flush()
+    freezer.close()
+
+    freezer = Freezer(str(tmpdir), segment_blocks=10)
+    assert len(freezer) == 1
+    freezer.append(1, b'c')
+    freezer.flush()
+    assert freezer.get(0) == b'a'
+    assert freezer.get(1) == b'c'
+
+
+def test_recover_index_past_segment(tmpdir):
+    freezer = Freezer(str(tmpdir), segment_blocks=2)
+    for number in range(3):
+        freezer.append(number, b'block%d' % number)
+    freezer.flush()
+    freezer.close()
+    with open(freezer._segment_path(1), 'r+b') as f:
+        f.truncate(3)  # index entry reached the disk, block data did not
+
+    freezer = Freezer(str(tmpdir), segment_blocks=2)
+    assert len(freezer) == 2
+    assert not tmpdir.join('blocks.000001').exists()
+    assert freezer.get(1) == b'block1'
+    freezer.append(2, b'other2')
+    freezer.flush()
+    assert freezer.get(2) == b'other2'
+
+
+def make_block(number):
+    header = [b''] * 8 + [int_to_big_endian(number)] + [b'\x00' * 32] * 6
+    return rlp.encode([header, [], []])
+
+
+def test_dbservice_freeze(tmpdir):
+    app = BaseApp(dict(data_dir=str(tmpdir),
+                       db=dict(implementation='EphemDB', freezer_distance=3)))
+    db = db_service.DBService(app)
+    db.put(b'GENESIS_NUMBER', b'0')
+    hashes = []
+    for number in range(1, 11):
+        block = make_block(number)
+        hashes.append(sha3(block))
+        db.put(hashes[-1], block)
+        db.put(b'block:%d' % number, hashes[-1])
+    db.put(b'head_hash', hashes[-1])
+
+    assert db.freeze() == 7
+    assert db.freeze() == 0
+    assert db.freezer.next_number == 8
+    assert db.db_service.get(b'frozen:' + hashes[0]) == b'1'
+    assert hashes[0] in db
+    assert db.get(hashes[0]) == make_block(1)
+    assert db.get_many([hashes[5], hashes[9]]) == [make_block(6), make_block(10)]
+
+
+def test_dbservice_pointers_restored(tmpdir):
+    app = BaseApp(dict(data_dir=str(tmpdir),
+                       db=dict(implementation='EphemDB', freezer_distance=3)))
+    db = db_service.DBService(app)
+    db.put(b'GENESIS_NUMBER', b'0')
+    hashes = []
+    for number in range(1, 11):
+        block = make_block(number)
+        hashes.append(sha3(block))
+        db.put(hashes[-1], block)
+        db.put(b'block:%d' % number, hashes[-1])
+    db.put(b'head_hash', hashes[-1])
+    assert db.freeze() == 7
+    # crash after the freezer flush, before the chain committed the pointers and deletes
+    for number in (6, 7):
+        db.db_service.delete(b'frozen:' + hashes[number - 1])
+        db.db_service.put(hashes[number - 1], make_block(number))
+    db.freezer_pointers_checked = False  # restart
+
+    assert db.freeze() == 0
+    assert db.freezer.next_number == 8
+    for number in (5, 6, 7):
+        assert db.db_service.get(b'frozen:' + hashes[number - 1]) == str(number).encode()
+        assert hashes[number - 1] not in db.db_service
+        assert db.get(hashes[number - 1]) == make_block(number)
+
+
+def test_dbservice_values_like_pointers(tmpdir):
+    app = BaseApp(dict(data_dir=str(tmpdir),
+                       db=dict(implementation='EphemDB', freezer_distance=3)))
+    db = db_service.DBService(app)
+    db.freezer.append(0, make_block(0))
+    db.freezer.flush()
+    # e.g. contract code, stored under its hash
+    for value in (b'FROZEN:0', b'FROZEN:x', b'frozen:0'):
+        key = sha3(value)
+        db.put(key, value)
+        assert db.get(key) == value
+        assert db.get_many([key]) == [value]
+    with pytest.raises(KeyError):
+        db.get(sha3(b'missing'))
@@ -0,0 +1,51 @@
+import time
+
+import gevent
+import pytest
+from pyethapp.db_io_pool import IOPool
+from pyethapp.tests.test_db_write_buffer import DictDB
+
+
+def test_run():
+    pool = IOPool(size=2)
+    assert pool.run('read', sum, [1, 2]) == 3
+    with pytest.raises(KeyError):
+        pool.run('read', {}.__getitem__, b'x')
+    gevent.sleep(0)  # timings are recorded on the hub
+    assert pool.stats()['timings']['read']['calls'] == 2
+    assert pool.stats()['in_flight'] == 0
+
+
+def test_hub_not_blocked():
+    pool = IOPool(size=1)
+    ticks = []
+
+    def tick():
+        for _ in range(5):
+            gevent.sleep(0.01)
+            ticks.append(1)
+
+    ticker = gevent.spawn(tick)
+    pool.run('write', time.sleep, 0.1)
+    ticker.join()
+    assert len(ticks) == 5
+
+
+def test_bounded_queue():
+    pool = IOPool(size=1, max_queue=1)
+    results = [pool.spawn('read', time.sleep, 0.05) for _ in range(2)]
+    assert pool.slots.counter == 0
+    third = gevent.spawn(pool.run, 'read', sum, [1])
+    gevent.sleep(0.01)
+    assert not third.ready()  # waits for a slot
+    assert third.get() == 1
+    for r in results:
+        r.get()
+
+
+def test_write_buffer_commit():
+    db = DictDB(io_pool=IOPool(size=1))
+    db.put(b'a', b'1')
+    db.commit()
+    assert db.db == {b'a': b'1'}
+    assert not db.flushing
@@ -0,0 +1,44 @@
+import pytest
+from devp2p.app import BaseApp
+from ethereum.db import EphemDB
+from ethereum.experimental.refcount_db import RefcountDB
+from pyethapp import db_service
+from pyethapp.ephemdb_service import EphemDB as EphemDBService
+
+
+def test_get_many_fallback():
+    db = EphemDB()
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    assert db_service.get_many(db, [b'b', b'x', b'a']) == [b'2', None, b'1']
+    assert db_service.contains_many(db, [b'b', b'x']) == [True, False]
+
+
+def test_get_many_refcount():
+    db = RefcountDB(EphemDBService(BaseApp()))
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    db.put(b'b', b'2')
+    assert db_service.get_many(db, [b'a', b'x', b'b']) == [b'1', None, b'2']
+    assert db_service.contains_many(db, [b'a', b'x']) == [True, False]
+
+
+def test_dbservice_get_many():
+    app = BaseApp(dict(db=dict(implementation='EphemDB')))
+    db = db_service.DBService(app)
+    db.put(b'a', b'1')
+    assert db.get_many([b'x', b'a']) == [None, b'1']
+    assert db.contains_many([b'x', b'a']) == [False, True]
+
+
+def test_dbservice_bloom_built_in_background(tmpdir):
+    pytest.importorskip('pyethapp.lmdb_service')
+    app = BaseApp(dict(data_dir=str(tmpdir), db=dict(implementation='LmDB', bloom_filter=True)))
+    db = db_service.DBService(app)
+    db.db_service.put(b'stored', b'1')
+    db.db_service.commit()
+    assert db.bloom is None  # not built on construction
+    db.put(b'put', b'2')  # before the build, still covered
+    db._build_bloom()
+    assert b'stored' in db.bloom and b'put' in db.bloom
+    assert b'x' not in db
@@ -0,0 +1,49 @@
+import rlp
+from devp2p.app import BaseApp
+from pyethapp import db_service
+from pyethapp.db_stores import BLOCKS, HEADERS, INDEX, META, TRIE, is_block, key_category
+
+block = rlp.encode([[b'\x01' * 32] * 15, [], []])
+trie_node = b'\x00\x00\x00\x01' + rlp.encode([b'\x01' * 32] * 17)
+
+
+def test_key_category():
+    assert key_category(b'block:12') == INDEX
+    assert key_category(b'header:' + b'\x01' * 32) == HEADERS
+    assert key_category(b'\x01' * 32) == TRIE
+    assert key_category('network_id') == META
+    assert key_category(b'head_hash') == META
+
+
+def test_is_block():
+    assert is_block(block)
+    assert is_block(b'GENESIS')
+    assert not is_block(trie_node)
+    assert not is_block(rlp.encode([b'\x01' * 100, b'\x02' * 100]))
+    assert not is_block(b'')
+
+
+def test_routing():
+    app = BaseApp(dict(db=dict(implementation='EphemDB', stores={
+        TRIE: dict(implementation='EphemDB'), INDEX: dict(implementation='EphemDB')})))
+    db = db_service.DBService(app)
+    assert len(db.backends()) == 3
+    block_hash, node_hash = b'\x01' * 32, b'\x02' * 32
+    db.put(block_hash, block)
+    db.put(node_hash, trie_node)
+    db.put(b'block:1', block_hash)
+    db.commit()
+
+    assert db.stores[TRIE].get(node_hash) == trie_node
+    assert node_hash not in db.stores[BLOCKS]
+    assert db.stores[BLOCKS].get(block_hash) == block
+    assert db.stores[INDEX].get(b'block:1') == block_hash
+    assert db.get(block_hash) == block
+    assert block_hash in db
+    assert db.get_many([node_hash, block_hash, b'block:1', b'\x03' * 32]) == \
+        [trie_node, block, block_hash, None]
+
+    db.delete(block_hash)
+    assert block_hash not in db
+    db.delete(node_hash)
+    assert node_hash not in db
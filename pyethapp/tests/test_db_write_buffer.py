@@ -0,0 +1,124 @@
+from builtins import object
+import pytest
+from pyethapp.db_write_buffer import WriteBuffer
+
+
+class DictDB(WriteBuffer):
+
+    def __init__(self, **options):
+        self.init_write_buffer(**options)
+        self.db = dict()
+        self.batches = []
+
+    def _write_batch(self, items, sync):
+        self.batches.append((len(items), sync))
+        for k, v in items.items():
+            if v is None:
+                self.db.pop(k, None)
+            else:
+                self.db[k] = v
+
+    def put(self, key, value):
+        self._buffer_write(key, value, len(key) + len(value))
+
+    def get(self, key):
+        value = self._buffered(key, object)
+        if value is object:
+            return self.db[key]
+        return value
+
+
+def test_commit_clears_buffer():
+    db = DictDB()
+    db.put(b'a', b'1')
+    assert db.get(b'a') == b'1'
+    assert b'a' not in db.db
+    db.commit()
+    assert db.db[b'a'] == b'1'
+    assert not db.uncommitted
+    assert db.uncommitted_bytes == 0
+
+
+def test_flush_on_key_threshold():
+    db = DictDB(flush_keys=3)
+    for i in range(7):
+        db.put(str(i).encode(), b'x')
+    assert db.batches == [(3, False), (3, False)]
+    assert len(db.uncommitted) == 1
+    assert len(db.db) == 6
+
+
+def test_flush_on_byte_threshold():
+    db = DictDB(flush_bytes=10)
+    db.put(b'a', b'x' * 5)
+    assert not db.batches
+    db.put(b'b', b'x' * 5)
+    assert db.batches == [(2, False)]
+
+
+def test_overwrites_counted_once():
+    db = DictDB(flush_bytes=10)
+    for _ in range(5):
+        db.put(b'a', b'x' * 4)
+    assert not db.batches
+    assert db.uncommitted_bytes == 5
+
+
+def test_failed_flush_kept():
+    class FailingOnceDB(DictDB):
+        failed = False
+
+        def _write_batch(self, items, sync):
+            if not self.failed:
+                self.failed = True
+                raise IOError('disk full')
+            DictDB._write_batch(self, items, sync)
+
+    db = FailingOnceDB()
+    db.put(b'a', b'1')
+    with pytest.raises(IOError):
+        db.commit()
+    assert db.get(b'a') == b'1'
+    db.put(b'b', b'2')
+    db.commit()
+    assert db.db == {b'a': b'1', b'b': b'2'}
+    assert not db.flushing
+    assert db.uncommitted_bytes == 0
+
+
+def test_sync_policy():
+    db = DictDB(sync_every=2)
+    for i in range(4):
+        db.put(b'a', b'x')
+        db.commit()
+    assert [sync for _, sync in db.batches] == [False, True, False, True]
+
+    db = DictDB(sync_every=1, flush_keys=1)
+    db.put(b'a', b'x')
+    assert db.batches == [(1, True)]
+
+
+def test_background_flush():
+    db = DictDB(background_flush=True, flush_keys=2)
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    # readable while being written
+    assert db.get(b'a') == b'1'
+    db.commit()
+    assert db.db == {b'a': b'1', b'b': b'2'}
+    assert not db.flushing
+
+
+def test_failed_background_flush():
+    class FailingDB(DictDB):
+        def _write_batch(self, items, sync):
+            raise IOError('disk full')
+
+    db = FailingDB(background_flush=True)
+    db.put(b'a', b'1')
+    db.flush()
+    db.put(b'b', b'2')
+    with pytest.raises(IOError):
+        db.wait_flushed()
+    assert sorted(db.uncommitted) == [b'a', b'b']
+    assert db.write_buffer_stats()['pending_bytes'] == 4
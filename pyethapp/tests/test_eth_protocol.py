@@ -1,10 +1,12 @@
 from __future__ import print_function
 from builtins import object
-from pyethapp.eth_protocol import ETHProtocol, TransientBlockBody
+from pyethapp.eth_protocol import ETHProtocol, TransientBlockBody, DuplicatesFilter
+from pyethapp.rlp_slices import block_body
 from devp2p.service import WiredService
 from devp2p.protocol import BaseProtocol
 from devp2p.app import BaseApp
 from ethereum.tools import tester
+from ethereum.transactions import Transaction
 import rlp
 
 
@@ -79,6 +81,10 @@ def test_blocks():
     packet = peer.packets.pop()
     assert len(rlp.decode(packet.payload)) == 3
 
+    # bodies cut from the block RLP are sent as they are
+    proto.send_blockbodies(*[block_body(rlp.encode(b)) for b in chain.blocks])
+    assert peer.packets.pop().payload == packet.payload
+
     def list_cb(proto, blocks):  # different cb, as we expect a list of blocks
         cb_data.append((proto, blocks))
 
@@ -112,3 +118,32 @@ def test_blocks():
     # assert that transactions and uncles have not been decoded
     assert len(_d['block'].transactions) == 0
     assert len(_d['block'].uncles) == 0
+
+
+def test_duplicates_filter():
+    f = DuplicatesFilter(max_items=2)
+    assert f.update(b'a')
+    assert f.update(b'b')
+    assert not f.update(b'a')  # b is now the least recently used
+    assert f.update(b'c')
+    assert b'a' in f and b'c' in f
+    assert b'b' not in f
+    assert len(f) == 2
+
+
+def test_known_hashes():
+    peer, proto, chain, cb_data, cb = setup()
+    tx = Transaction(0, 1, 21000, b'\x00' * 20, 0, b'').sign(tester.k0)
+    proto.send_transactions(tx)
+    assert tx.hash in proto.known_txs
+
+    peer2, proto2, _, _, _ = setup()
+    proto2._receive_transactions(peer.packets.pop())
+    assert tx.hash in proto2.known_txs
+
+    chain.mine(number_of_blocks=1)
+    block = chain.chain.head
+    proto.send_newblock(block=block, chain_difficulty=1)
+    assert block.hash in proto.known_blocks
+    proto2._receive_newblock(peer.packets.pop())
+    assert block.hash in proto2.known_blocks
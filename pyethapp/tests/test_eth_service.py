@@ -1,6 +1,8 @@
 from builtins import range
 from builtins import object
 import os
+import gevent
+import gevent.event
 import pytest
 from ethereum.db import EphemDB
 from ethereum.utils import (
@@ -15,6 +17,7 @@ from pyethapp import eth_protocol
 from ethereum import slogging
 from ethereum.tools import tester
 from ethereum import config as eth_config
+from ethereum.pow import ethpow
 from ethereum.transactions import Transaction
 import rlp
 import tempfile
@@ -31,6 +34,7 @@ class AppMock(object):
             coinbase = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
 
         class peermanager(object):
+            peers = []
 
             @classmethod
             def broadcast(*args, **kwargs):
@@ -166,6 +170,131 @@ def test_head_candidate(test_app):
         tx = make_transaction(tester.keys[i], 0, 0, tester.accounts[2])
         chainservice.add_transaction(tx)
         assert len(chainservice.head_candidate.transactions) == i + 1
+    assert chainservice.head_candidate_stats['rebuilds'] == 1
+    assert chainservice.head_candidate_stats['extensions'] == 5
+
+
+def test_head_candidate_rebuild_with_pending_txs(test_app):
+    chainservice = test_app.chain
+    chainservice.add_transaction(make_transaction(tester.keys[0], 0, 1, tester.accounts[2]))
+    chainservice._head_candidate_needs_updating = True
+    assert len(chainservice.head_candidate.transactions) == 1
+
+
+def test_head_candidate_failed_extension(test_app):
+    chainservice = test_app.chain
+    sealed = chainservice.head_candidate
+    # both valid when added, as the first one is not applied before the candidate is read,
+    # but it leaves too little balance for the second one
+    gas_cost = 20 * 10**9 * 500 * 1000
+    chainservice.add_transaction(
+        make_transaction(tester.keys[0], 0, 10 ** 24 - gas_cost, tester.accounts[2]))
+    chainservice.add_transaction(make_transaction(tester.keys[0], 1, 1, tester.accounts[2]))
+    assert len(chainservice.head_candidate.transactions) == 1
+    assert chainservice.head_candidate_stats['rebuilds'] == 2
+    assert sealed.transactions == []  # handed out candidates are not modified
+
+
+def test_add_transactions_batch(test_app):
+    chainservice = test_app.chain
+    txs = [make_transaction(tester.keys[0], nonce, 0, tester.accounts[2]) for nonce in range(3)]
+    future = make_transaction(tester.keys[1], 2, 0, tester.accounts[2])
+    too_expensive = make_transaction(tester.keys[3], 0, 10 ** 25, tester.accounts[2])
+    # each affordable, but not both
+    spends = [make_transaction(tester.keys[4], nonce, 6 * 10 ** 23, tester.accounts[2])
+              for nonce in range(2)]
+    chainservice.add_transactions([txs[2], future, txs[0], txs[0], too_expensive, txs[1],
+                                   spends[1], spends[0]])
+    assert chainservice.txpool.status() == dict(pending=4, queued=1)
+    assert [tx.nonce for tx in chainservice.head_candidate.transactions
+            if tx.sender == tester.accounts[0]] == [0, 1, 2]
+    assert spends[0] in chainservice.head_candidate.transactions
+    chainservice.add_transactions(txs)  # known
+    assert chainservice.txpool.status() == dict(pending=4, queued=1)
+
+
+def test_add_transaction_unfundable_future(test_app):
+    chainservice = test_app.chain
+    chainservice.add_transaction(make_transaction(tester.keys[0], 1, 10 ** 25, tester.accounts[2]))
+    chainservice.add_transactions([make_transaction(tester.keys[1], 1, 10 ** 25,
+                                                    tester.accounts[2])])
+    assert len(chainservice.txpool) == 0
+
+
+class PropagationPeerMock(object):
+
+    class ProtoMock(object):
+
+        is_stopped = False
+
+        def __init__(self, peer):
+            self.peer = peer
+            self.known_blocks = eth_protocol.DuplicatesFilter()
+            self.known_txs = eth_protocol.DuplicatesFilter()
+            self.received = []
+
+        def send_newblock(self, block, chain_difficulty):
+            self.known_blocks.update(block.header.hash)
+            self.received.append('newblock')
+
+        def send_newblockhashes(self, *data):
+            for d in data:
+                self.known_blocks.update(d.hash)
+            self.received.append('newblockhashes')
+
+        def send_transactions(self, *transactions):
+            for tx in transactions:
+                self.known_txs.update(tx.hash)
+            self.received.append(len(transactions))
+
+    def __init__(self):
+        self.protocols = {eth_protocol.ETHProtocol: self.ProtoMock(self)}
+        self.safe_to_read = gevent.event.Event()
+        self.safe_to_read.set()
+
+
+def test_broadcast_newblock(test_app, monkeypatch):
+    chainservice = test_app.chain
+    peers = [PropagationPeerMock() for _ in range(9)]
+    monkeypatch.setattr(test_app.services.peermanager, 'peers', peers)
+    chainservice.broadcast_newblock(chainservice.chain.head, chain_difficulty=1)
+    received = [p.protocols[eth_protocol.ETHProtocol].received for p in peers]
+    assert sorted(received).count(['newblock']) == 3
+    assert sorted(received).count(['newblockhashes']) == 6
+    stats = chainservice.propagation_summary()
+    assert stats['full'] == 3 and stats['announced'] == 6
+    assert stats['delay']['count'] == 1
+
+    # not imported yet, announced once it is
+    block = tester.Chain().mine(1)
+    chainservice.broadcast_newblock(block, chain_difficulty=1)
+    assert block.hash in chainservice.pending_announcements
+    assert chainservice.propagation_summary()['announced'] == 6
+
+    chainservice.block_propagation = 'all'
+    assert chainservice.num_full_propagation(9) == 9
+    chainservice.block_propagation = 'sqrt'
+    assert [chainservice.num_full_propagation(n) for n in (0, 1, 2, 25)] == [0, 1, 1, 5]
+
+
+def test_broadcast_transactions_batched(test_app, monkeypatch):
+    chainservice = test_app.chain
+    chainservice.tx_batch_size = 3
+    peers = [PropagationPeerMock() for _ in range(2)]
+    monkeypatch.setattr(test_app.services.peermanager, 'peers', peers)
+    protos = [p.protocols[eth_protocol.ETHProtocol] for p in peers]
+    txs = [make_transaction(tester.keys[0], nonce, 0, tester.accounts[2]) for nonce in range(4)]
+    protos[1].known_txs.update(txs[0].hash)  # received from that peer
+    chainservice.broadcast_transactions(txs[:2])
+    chainservice.broadcast_transaction(txs[1])  # filtered
+    assert [p.received for p in protos] == [[], []]
+    chainservice.broadcast_transaction(txs[2])
+    assert [p.received for p in protos] == [[3], []]  # full batch sent at once
+    chainservice.broadcast_transaction(txs[3])
+    gevent.sleep(chainservice.tx_batch_interval * 2)
+    assert [p.received for p in protos] == [[3, 1], [3]]
+    assert chainservice.tx_outbox == dict()
+    assert chainservice.tx_batch_sizes.count == 3
 
 
 def make_transaction(key, nonce, value, to):
@@ -245,3 +374,145 @@ def test_query_headers(test_app):
     assert len(headers) == 5
     assert headers[0].number == 10
     assert headers[-1].number == 14
+
+    # headers are stored on the first lookup
+    blockhash = test_chain.chain.get_block_by_number(12).hash
+    assert b'header:' + blockhash in test_chain.chain.db
+    assert chainservice.get_headers([blockhash, None]) == [headers[2], None]
+
+    # case 5: hash_mode from a block off the canonical chain
+    test_chain.change_head(test_chain.chain.get_block_by_number(20).hash)
+    side_hash = test_chain.mine(1).hash
+    assert test_chain.chain.head.number == 30
+    headers = chainservice.query_headers(1, 5, 1, True, origin_hash=side_hash)
+    assert [h.number for h in headers] == [21, 19, 17, 15, 13]
+    headers = chainservice.query_headers(1, 5, 0, False, origin_hash=side_hash)
+    assert [h.number for h in headers] == [21]
+
+
+def test_block_queue_index():
+    class Header(object):
+        def __init__(self, h):
+            self.hash = h
+
+    class Block(object):
+        def __init__(self, h):
+            self.header = Header(h)
+
+    q = eth_service.BlockQueue(maxsize=10)
+    q.put((Block(b'a'), None))
+    q.put((Block(b'b'), None))
+    q.put((Block(b'a'), None))
+    assert b'a' in q and b'b' in q
+    q.peek()
+    assert b'a' in q  # still queued while peeked
+    q.get()
+    assert b'a' in q  # queued twice
+    q.get()
+    q.get()
+    assert b'a' not in q and b'b' not in q
+    assert not q.hashes
+
+
+def test_block_queue_end_marker():
+    q = eth_service.BlockQueue(maxsize=2)
+    q.put(eth_service.BlockQueue.END)
+    assert not q.hashes
+    assert q.get() is eth_service.BlockQueue.END
+
+
+def test_block_buffer(monkeypatch):
+    class Header(object):
+        def __init__(self, h, prevhash):
+            self.hash = h
+            self.prevhash = prevhash
+
+    class Block(object):
+        def __init__(self, h, prevhash):
+            self.header = Header(h, prevhash)
+
+    buf = eth_service.BlockBuffer(max_size=3, max_age=10.)
+    a, b, c = Block(b'a', b'p'), Block(b'b', b'p'), Block(b'c', b'a')
+    for block in (a, b, c, a):
+        buf.add(block, block, None)
+    assert len(buf) == 3 and b'c' in buf
+    assert sorted(e[0].header.hash for e in buf.pop_children(b'p')) == [b'a', b'b']
+    assert buf.pop_children(b'p') == []
+    assert len(buf) == 1
+
+    # bounded in size, oldest dropped first
+    for h in (b'd', b'e', b'f'):
+        buf.add(Block(h, b'x'), None, None)
+    assert b'c' not in buf and len(buf) == 3
+    assert b'x' in buf.children and b'a' not in buf.children
+
+    # and in age, also when only looked up
+    now = eth_service.time.time()
+    monkeypatch.setattr(eth_service.time, 'time', lambda: now + 11.)
+    buf.add(Block(b'g', b'f'), None, None)
+    assert list(buf.entries) == [b'g']
+    assert list(buf.children) == [b'f']
+    monkeypatch.setattr(eth_service.time, 'time', lambda: now + 22.)
+    assert b'g' not in buf
+    assert not buf.children
+
+
+def test_buffered_block_not_known(test_app):
+    chainservice = test_app.chain
+    block = tester.Chain().mine(2)  # its parent is not in the chain
+    chainservice.block_buffer.add(block, block, None)
+    # announced again, the synchronizer fetches the missing parent
+    assert not chainservice.knows_block(block.hash)
+    chainservice.add_block(block, None)  # but it is not queued twice
+    assert chainservice.block_queue.empty()
+
+
+def test_decoder_failure(test_app):
+    chainservice = test_app.chain
+
+    class BrokenBlock(object):
+        senders_recovered = True
+        header = tester.Chain().mine(1).header
+
+        def to_block(self):
+            raise KeyError('unexpected')
+
+    chainservice.add_block(BrokenBlock(), None)
+    with gevent.Timeout(5):
+        while chainservice.add_blocks_lock:
+            gevent.sleep(0.01)
+    assert chainservice.block_queue.empty() and chainservice.decoded_queue.empty()
+    assert not chainservice.add_transaction_lock.locked()
+
+
+def test_pow_checks_cached_until_execution(monkeypatch):
+    checks = []
+    monkeypatch.setattr(ethpow, 'get_cache', lambda block_number: None)
+    monkeypatch.setattr(ethpow, 'hashimoto_light', lambda number, cache, header_hash, nonce:
+                        checks.append(header_hash) or {b'mix digest': b'', b'result': b''})
+
+    def check(header_hash):
+        ethpow.check_pow(1, header_hash, b'\x00' * 32, b'\x00' * 8, 1)
+
+    block = os.urandom(32)
+    check(block)
+    # the decoded blocks, the one waiting to be queued, and the uncles of executed blocks
+    depth = eth_service.ChainService.decoded_queue_size + 1
+    max_uncles = eth_config.default_config['MAX_UNCLES']
+    for _ in range(depth * (1 + max_uncles)):
+        check(os.urandom(32))
+    check(block)  # on execution
+    assert checks.count(block) == 1
+
+
+def test_import_stats():
+    eth = eth_service.ChainService(AppMock())
+    assert set(eth.import_stats()) == set(eth.import_stages)
+    assert eth.import_stats()['execute']['count'] == 0
+    assert eth.import_stats()['execute']['blocks_per_sec'] == 0.
+    eth._count_stage('decode', 4, 2.)
+    stats = eth.import_stats()['decode']
+    assert stats['count'] == 4
+    assert stats['blocks_per_sec'] == 2.
+    assert stats['min'] == stats['max'] == 0.5
+    assert 0.5 <= stats['p50'] <= 0.5 * 1.25
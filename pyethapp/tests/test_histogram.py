@@ -0,0 +1,34 @@
+import random
+
+from pyethapp.histogram import Histogram
+
+
+def test_empty():
+    h = Histogram()
+    assert h.percentile(50) == 0.
+    assert h.summary() == dict(count=0, sum=0., mean=0., min=0., max=0., p50=0., p90=0., p99=0.)
+
+
+def test_percentiles():
+    h = Histogram()
+    values = [random.expovariate(100.) for _ in range(10000)]
+    for v in values:
+        h.add(v)
+    values.sort()
+    for p in (1, 50, 90, 99, 100):
+        exact = values[int(p / 100. * len(values)) - 1]
+        assert exact <= h.percentile(p) <= exact * 1.25 + h.resolution
+    assert h.percentile(100) == h.max == values[-1]
+    assert h.min == values[0]
+    assert abs(h.mean - sum(values) / len(values)) < 1e-9
+
+
+def test_add_count():
+    h = Histogram()
+    h.add(0.01, count=3)
+    h.add(1.)
+    summary = h.summary(percentiles=(50, 75, 90))
+    assert summary['count'] == 4
+    assert summary['sum'] == 1.03
+    assert 0.01 <= summary['p50'] == summary['p75'] <= 0.0125
+    assert summary['p90'] == 1.
@@ -0,0 +1,39 @@
+import pytest
+from devp2p.app import BaseApp
+
+lmdb_service = pytest.importorskip('pyethapp.lmdb_service')
+
+
+@pytest.fixture
+def db(tmpdir):
+    app = BaseApp(dict(data_dir=str(tmpdir)))
+    return lmdb_service.LmDBService(app)
+
+
+def test_commit_clears_uncommitted(db):
+    db.put(b'a', b'1')
+    db.commit()
+    assert not db.uncommitted
+    assert db.get(b'a') == b'1'
+    assert not db.uncommitted  # reads are not buffered
+
+
+def test_read_transaction_renewed(db):
+    db.put(b'a', b'1')
+    db.commit()
+    assert db.get(b'a') == b'1'
+    db.put(b'a', b'2')
+    db.delete(b'b')
+    db.commit()
+    assert db.get(b'a') == b'2'
+    with pytest.raises(KeyError):
+        db.get(b'b')
+
+
+def test_get_many(db):
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    db.commit()
+    db.put(b'c', b'3')
+    db.delete(b'b')
+    assert db.get_many([b'c', b'a', b'b', b'd']) == [b'3', b'1', None, None]
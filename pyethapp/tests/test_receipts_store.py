@@ -0,0 +1,42 @@
+from ethereum.db import EphemDB
+from ethereum.messages import Log, Receipt
+from ethereum.utils import sha3
+
+from pyethapp.receipts_store import ReceiptsStore, PREFIX
+
+
+def make_receipts(n):
+    return [Receipt(b'\x01', 21000 * (i + 1),
+                    [Log(b'\x11' * 20, [i], b'data')] if i % 2 else [])
+            for i in range(n)]
+
+
+def test_put_get():
+    db = EphemDB()
+    store = ReceiptsStore(db)
+    blockhash = sha3(b'block')
+    assert store.get(blockhash) is None
+    assert blockhash not in store
+    store.put(blockhash, make_receipts(3))
+    assert PREFIX + blockhash in db
+    assert blockhash in store
+
+    # decoded from the database by a fresh store
+    receipts = ReceiptsStore(db).get(blockhash)
+    assert [r.gas_used for r in receipts] == [21000, 42000, 63000]
+    # decoded sequences are tuples
+    assert len(receipts[1].logs) == 1 and list(receipts[1].logs[0].topics) == [1]
+    assert list(receipts[0].logs) == []
+
+
+def test_lru():
+    store = ReceiptsStore(EphemDB(), cache_size=2)
+    hashes = [sha3(str(i).encode()) for i in range(3)]
+    for blockhash in hashes:
+        store.put(blockhash, make_receipts(1))
+    assert list(store.cache) == hashes[1:]
+    store.get(hashes[1])
+    assert store.hits == 1
+    store.get(hashes[0])  # from the database, evicts the least recently used
+    assert store.misses == 1
+    assert list(store.cache) == [hashes[1], hashes[0]]
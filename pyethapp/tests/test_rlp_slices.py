@@ -0,0 +1,34 @@
+import pytest
+import rlp
+
+from pyethapp.rlp_slices import item_bounds, list_items, encode_list, block_body
+
+
+def test_list_items():
+    items = [b'', b'\x01', b'a' * 55, b'b' * 56, b'c' * 1024, [], [b'x'] * 60, [[b'y'], b'z']]
+    data = rlp.encode(items)
+    assert [rlp.decode(item) for item in list_items(data)] == items
+    assert item_bounds(data)[1] == len(data)
+    assert list_items(rlp.encode([])) == []
+
+
+def test_invalid():
+    with pytest.raises(rlp.DecodingError):
+        list_items(rlp.encode(b'not a list'))
+    with pytest.raises(rlp.DecodingError):
+        list_items(rlp.encode([b'abc', b'def'])[:-1])
+    with pytest.raises(rlp.DecodingError):
+        list_items(b'')
+
+
+def test_encode_list():
+    for items in ([], [b'a'], [b'x' * 100] * 3, [[b'y'] * 70, b'']):
+        encoded = [rlp.encode(item) for item in items]
+        assert encode_list(encoded) == rlp.encode(items)
+
+
+def test_block_body():
+    header, txs, uncles = [b'h' * 10] * 15, [[b't'] * 9] * 3, [[b'u' * 20] * 15]
+    assert block_body(rlp.encode([header, txs, uncles])) == rlp.encode([txs, uncles])
+    with pytest.raises(rlp.DecodingError):
+        block_body(rlp.encode([header, txs]))
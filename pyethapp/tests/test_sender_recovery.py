@@ -0,0 +1,45 @@
+import gevent
+import rlp
+from ethereum.tools import tester
+from ethereum.transactions import Transaction
+from pyethapp.sender_recovery import SenderRecoveryPool, recover_senders
+
+
+def make_txs(num, key=tester.k0):
+    txs = [Transaction(i, 1, 21000, b'\x00' * 20, 0, b'').sign(key) for i in range(num)]
+    # decoded from the wire, the senders are not known yet
+    return [rlp.decode(rlp.encode(tx), Transaction) for tx in txs]
+
+
+def test_recover_senders():
+    txs = make_txs(2)
+    invalid = rlp.encode(Transaction(0, 1, 21000, b'\x00' * 20, 0, b'', v=27, r=1, s=0))
+    assert recover_senders([rlp.encode(tx) for tx in txs] + [invalid]) == \
+        [tester.a0, tester.a0, None]
+
+
+def test_pool():
+    pool = SenderRecoveryPool(2)
+    try:
+        txs = make_txs(3)
+        pool.min_batch = 1
+        assert pool.recover(txs) == 3
+        assert all(tx._sender == tester.a0 for tx in txs)
+        assert pool.recover(txs) == 0  # already recovered
+    finally:
+        pool.stop()
+
+
+def test_pool_caller_killed():
+    pool = SenderRecoveryPool(2)
+    try:
+        pool.min_batch = 1
+        killed_txs, txs = make_txs(8), make_txs(8, tester.k1)
+        caller = gevent.spawn(pool.recover, killed_txs)
+        gevent.sleep(0)  # waits for the workers now
+        caller.kill()
+        assert pool.recover(txs) == 8
+        assert all(tx._sender == tester.a1 for tx in txs)
+        assert all(tx._sender in (None, tester.a0) for tx in killed_txs)
+    finally:
+        pool.stop()
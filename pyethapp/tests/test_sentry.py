@@ -0,0 +1,114 @@
+import json
+import os
+
+import gevent
+import pytest
+from gevent.pywsgi import WSGIServer
+from pyethapp.sentry import BadBlockReporter
+
+
+@pytest.fixture
+def stub_server():
+    """local endpoint recording the posted reports, answering with `server.fail_status` while
+    `server.fail` is positive"""
+    def application(environ, start_response):
+        if server.fail > 0:
+            server.fail -= 1
+            start_response(server.fail_status, [])
+            return [b'']
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        server.received.append(json.loads(body.decode('utf-8')))
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    server = WSGIServer(('127.0.0.1', 0), application, log=None)
+    server.received = []
+    server.fail = 0
+    server.fail_status = '500 Internal Server Error'
+    server.start()
+    server.url = 'http://127.0.0.1:%d/' % server.server_port
+    yield server
+    server.stop()
+
+
+def wait_for(condition, timeout=5.):
+    with gevent.Timeout(timeout):
+        while not condition():
+            gevent.sleep(0.01)
+
+
+def test_report(stub_server, tmpdir):
+    reporter = BadBlockReporter(stub_server.url, str(tmpdir), min_backoff=0.01)
+    reporter.report([b'block1'], 'InvalidNonce')
+    reporter.report([b'block2'])
+    reporter.start()
+    wait_for(lambda: reporter.stats['sent'] == 2)
+    reporter.stop()
+    assert stub_server.received == [
+        dict(block='c786626c6f636b31', errortype='InvalidNonce'),
+        dict(block='c786626c6f636b32', errortype='other')]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_retry(stub_server):
+    stub_server.fail = 2
+    reporter = BadBlockReporter(stub_server.url, min_backoff=0.01)
+    reporter.start()
+    reporter.report([b'block'])
+    wait_for(lambda: reporter.stats['sent'] == 1)
+    reporter.stop()
+    assert reporter.stats['failures'] == 2
+    assert len(stub_server.received) == 1
+
+
+def test_rejected_dropped(stub_server, tmpdir):
+    stub_server.fail = 1
+    stub_server.fail_status = '400 Bad Request'
+    reporter = BadBlockReporter(stub_server.url, str(tmpdir), min_backoff=0.01)
+    reporter.report([b'rejected'])
+    reporter.report([b'block'])
+    reporter.start()
+    wait_for(lambda: reporter.stats['sent'] == 1)
+    reporter.stop()
+    assert reporter.stats['dropped'] == 1 and reporter.stats['failures'] == 1
+    assert stub_server.received == [dict(block='c685626c6f636b', errortype='other')]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_dropped_after_max_attempts(stub_server):
+    stub_server.fail = 3
+    reporter = BadBlockReporter(stub_server.url, max_attempts=3, min_backoff=0.01)
+    reporter.report([b'failing'])
+    reporter.report([b'block'])
+    reporter.start()
+    wait_for(lambda: reporter.stats['sent'] == 1)
+    reporter.stop()
+    assert reporter.stats['dropped'] == 1 and reporter.stats['failures'] == 3
+    assert len(stub_server.received) == 1
+
+
+def test_spool_survives_restart(stub_server, tmpdir):
+    reporter = BadBlockReporter('http://127.0.0.1:1/', str(tmpdir))
+    reporter.report([b'block'])
+    reporter._spool_queued()
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    reporter = BadBlockReporter(stub_server.url, str(tmpdir))
+    assert len(reporter.spooled) == 1
+    reporter.start()
+    wait_for(lambda: reporter.stats['sent'] == 1)
+    reporter.stop()
+    assert stub_server.received[0]['block'] == 'c685626c6f636b'
+
+
+def test_bounded():
+    reporter = BadBlockReporter('http://127.0.0.1:1/', max_queued=2, max_spooled=2)
+    for i in range(3):
+        reporter.report([i])
+    assert reporter.stats == dict(queued=2, dropped=1, sent=0, failures=0)
+    reporter._spool_queued()
+    for i in range(2):
+        reporter.report([i])
+    reporter._spool_queued()
+    assert len(reporter.spooled) == 2
+    assert reporter.stats['dropped'] == 3
@@ -0,0 +1,95 @@
+from ethereum.tools import tester
+from ethereum.transactions import Transaction
+
+from pyethapp.txpool import TxPool
+
+
+def make_tx(key, nonce, gasprice=20 * 10**9, startgas=21000, value=0):
+    return Transaction(nonce, gasprice, startgas, tester.accounts[9], value, b'').sign(key)
+
+
+def test_pending_and_queued():
+    pool = TxPool()
+    key = tester.keys[0]
+    assert pool.add(make_tx(key, 5), 3) == []  # gap, queued
+    assert pool.status() == dict(pending=0, queued=1)
+    tx3 = make_tx(key, 3)
+    assert pool.add(tx3, 3) == [tx3]
+    assert pool.status() == dict(pending=1, queued=1)
+    tx4 = make_tx(key, 4)
+    assert [tx.nonce for tx in pool.add(tx4, 3)] == [4, 5]  # fills the gap
+    assert pool.status() == dict(pending=3, queued=0)
+    assert pool.add(tx4, 3) is None  # known
+    assert pool.add(make_tx(key, 2), 3) is None  # stale nonce
+    content = pool.content()
+    assert sorted(content['pending'][tester.accounts[0]]) == [3, 4, 5]
+    assert content['queued'] == {}
+
+
+def test_replacement():
+    pool = TxPool()
+    key = tester.keys[0]
+    pool.add(make_tx(key, 0), 0)
+    pool.add(make_tx(key, 1), 0)
+    assert pool.add(make_tx(key, 0, gasprice=10 * 10**9), 0) is None  # cheaper
+    expensive = make_tx(key, 0, gasprice=30 * 10**9)
+    assert [tx.nonce for tx in pool.add(expensive, 0)] == [0, 1]
+    assert len(pool) == 2 and expensive.hash in pool
+    assert pool.status() == dict(pending=2, queued=0)
+
+
+def test_remove_included():
+    pool = TxPool()
+    txs = [make_tx(tester.keys[0], nonce) for nonce in range(4)]
+    for tx in txs:
+        pool.add(tx, 0)
+    other = make_tx(tester.keys[1], 0)
+    pool.add(other, 0)
+    pool.remove_included(txs[:2])
+    assert len(pool) == 3
+    assert pool.status() == dict(pending=3, queued=0)
+    pool.remove_included([txs[3]])  # also drops the obsolete txs[2]
+    assert list(pool.txs) == [other.hash]
+    assert tester.accounts[0] not in pool.senders
+
+
+def test_eviction():
+    pool = TxPool(max_txs=3)
+    cheap = make_tx(tester.keys[0], 0, gasprice=1)
+    forced = make_tx(tester.keys[1], 0, gasprice=1)
+    pool.add(cheap, 0)
+    pool.add(forced, 0, force=True)
+    pool.add(make_tx(tester.keys[2], 0, gasprice=5), 0)
+    pool.add(make_tx(tester.keys[3], 0, gasprice=7), 0)
+    assert len(pool) == 3 and cheap.hash not in pool and forced.hash in pool
+    assert pool.evicted == 1
+    assert pool.add(make_tx(tester.keys[4], 0, gasprice=2), 0) is None  # cheapest itself
+    assert pool.status() == dict(pending=3, queued=0)
+
+    pool = TxPool(max_bytes=150)  # about 100 bytes per tx
+    pool.add(make_tx(tester.keys[0], 0, gasprice=3), 0)
+    pool.add(make_tx(tester.keys[1], 0, gasprice=2), 0)
+    assert len(pool) == 1 and pool.size <= 150
+
+
+def test_selection():
+    pool = TxPool()
+    pool.add(make_tx(tester.keys[0], 0, gasprice=1), 0)
+    pool.add(make_tx(tester.keys[0], 1, gasprice=9), 0)
+    pool.add(make_tx(tester.keys[1], 0, gasprice=5), 0)
+    pool.add(make_tx(tester.keys[2], 0, gasprice=2, startgas=50000), 0)
+    pool.add(make_tx(tester.keys[3], 0, gasprice=1), 0, force=True)
+    pool.add(make_tx(tester.keys[4], 1, gasprice=99), 0)  # queued
+    selection = pool.selection()
+    assert len(selection) == 5
+    order = []
+    while True:
+        tx = selection.pop_transaction(max_gas=40000)
+        if tx is None:
+            break
+        order.append((tx.sender, tx.nonce))
+    accounts = tester.accounts
+    # forced first, then by price, but a sender's txs in nonce order
+    assert order == [(accounts[3], 0), (accounts[1], 0), (accounts[0], 0), (accounts[0], 1)]
+    assert len(selection) == 0
+    assert len(pool) == 6  # the pool is not modified
@@ -0,0 +1,232 @@
+# -*- coding: utf8 -*-
+from __future__ import absolute_import
+from builtins import object
+import heapq
+
+import rlp
+from ethereum.slogging import get_logger
+from ethereum.transaction_queue import PRIO_INFINITY
+
+log = get_logger('eth.txpool')
+
+
+class TxPool(object):
+
+    """
+    Transaction pool, indexed by hash and by sender.
+
+    The transactions of a sender are kept by nonce. Those with nonces following the account
+    nonce of the sender without a gap are *pending*, they can be included in the next block.
+    Those after a gap are *queued* until the gap is filled.
+
+    If the pool holds more than `max_txs` transactions or `max_bytes` of RLP, the transactions
+    with the lowest gas price are evicted, except for forced ones. The price heap used for
+    this is cleaned lazily.
+    """
+
+    def __init__(self, max_txs=4096, max_bytes=32 * 1024**2):
+        self.max_txs = max_txs
+        self.max_bytes = max_bytes
+        self.txs = dict()  # hash: tx
+        self.info = dict()  # hash: (sender, size, counter)
+        self.senders = dict()  # sender: {nonce: tx}
+        self.nonces = dict()  # sender: account nonce, as of the head
+        self.pending_end = dict()  # sender: first nonce which is not pending
+        self.forced = set()  # hashes of forced txs, included first and never evicted
+        self.price_heap = []  # (gasprice, counter, hash), possibly of removed txs
+        self.counter = 0
+        self.num_pending = 0
+        self.size = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.txs)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.txs
+
+    def get(self, tx_hash):
+        return self.txs.get(tx_hash)
+
+    def add(self, tx, account_nonce, force=False):
+        """Adds `tx` for a sender whose account nonce is `account_nonce` at the head.
+
+        A transaction replaces one of the same sender and nonce if its gas price is higher.
+
+        :returns: `None` if `tx` was not added, else the transactions which became pending,
+                  `tx` and those queued behind it
+        """
+        if tx.hash in self.txs:
+            return None
+        sender = tx.sender
+        if sender in self.senders:
+            self._advance(sender, account_nonce)
+        else:
+            self.senders[sender] = dict()
+            self.nonces[sender] = self.pending_end[sender] = account_nonce
+        if tx.nonce < self.nonces[sender]:
+            self._drop_empty(sender)
+            return None
+        existing = self.senders[sender].get(tx.nonce)
+        if existing is not None:
+            if tx.gasprice <= existing.gasprice:
+                return None
+            log.debug('replacing tx', old=existing, new=tx)
+            self._remove(existing.hash)  # the ones after it are promoted again below
+        size = len(rlp.encode(tx))
+        self.txs[tx.hash] = tx
+        self.info[tx.hash] = (sender, size, self.counter)
+        self.senders[sender][tx.nonce] = tx
+        self.size += size
+        if force:
+            self.forced.add(tx.hash)
+        heapq.heappush(self.price_heap, (tx.gasprice, self.counter, tx.hash))
+        self.counter += 1
+        promoted = self._promote(sender)
+        self._evict()
+        if tx.hash not in self.txs:
+            return None
+        return [t for t in promoted if t.hash in self.txs]
+
+    def _promote(self, sender):
+        txs = self.senders[sender]
+        promoted = []
+        while self.pending_end[sender] in txs:
+            promoted.append(txs[self.pending_end[sender]])
+            self.pending_end[sender] += 1
+        self.num_pending += len(promoted)
+        return promoted
+
+    def _remove(self, tx_hash):
+        tx = self.txs.pop(tx_hash)
+        sender, size, _ = self.info.pop(tx_hash)
+        del self.senders[sender][tx.nonce]
+        self.forced.discard(tx_hash)
+        self.size -= size
+        if tx.nonce < self.pending_end[sender]:  # the ones after it are queued now
+            self.num_pending -= self.pending_end[sender] - tx.nonce
+            self.pending_end[sender] = tx.nonce
+
+    def _drop_empty(self, sender):
+        if not self.senders[sender]:
+            del self.senders[sender]
+            del self.nonces[sender]
+            del self.pending_end[sender]
+
+    def _advance(self, sender, account_nonce):
+        "drops the txs of `sender` made obsolete by a new account nonce"
+        if account_nonce <= self.nonces[sender]:
+            return
+        txs = self.senders[sender]
+        stale = [nonce for nonce in txs if nonce < account_nonce]
+        # removed in order, so that the pending ones stay pending
+        self.num_pending -= sum(1 for nonce in stale if nonce < self.pending_end[sender])
+        for nonce in stale:
+            tx_hash = txs.pop(nonce).hash
+            del self.txs[tx_hash]
+            self.size -= self.info.pop(tx_hash)[1]
+            self.forced.discard(tx_hash)
+        self.nonces[sender] = account_nonce
+        if self.pending_end[sender] < account_nonce:
+            self.pending_end[sender] = account_nonce
+            self._promote(sender)
+
+    def _evict(self):
+        while len(self.txs) > self.max_txs or self.size > self.max_bytes:
+            if not self.price_heap:
+                break  # only forced txs left
+            _, _, tx_hash = heapq.heappop(self.price_heap)
+            if tx_hash not in self.txs:
+                continue  # removed already
+            if tx_hash in self.forced:
+                continue
+            sender = self.info[tx_hash][0]
+            self._remove(tx_hash)
+            self._drop_empty(sender)
+            self.evicted += 1
+        if len(self.price_heap) > 2 * len(self.txs) + 64:
+            self.price_heap = [(self.txs[h].gasprice, self.info[h][2], h)
+                               for h in self.txs if h not in self.forced]
+            heapq.heapify(self.price_heap)
+
+    def remove_included(self, transactions):
+        "removes the `transactions` of a new head and the ones they made obsolete"
+        for tx in transactions:
+            sender = tx.sender
+            if sender in self.senders:
+                self._advance(sender, tx.nonce + 1)
+                self._drop_empty(sender)
+
+    def selection(self):
+        "the pending transactions for a new block, see :class:`PendingSelection`"
+        return PendingSelection(self)
+
+    def pending(self):
+        "returns the pending transactions, by sender and in nonce order"
+        return [txs[nonce] for sender, txs in self.senders.items()
+                for nonce in range(self.nonces[sender], self.pending_end[sender])]
+
+    def status(self):
+        return dict(pending=self.num_pending, queued=len(self.txs) - self.num_pending)
+
+    def content(self):
+        "returns the pending and queued transactions, as dicts of sender: {nonce: tx}"
+        content = dict(pending=dict(), queued=dict())
+        for sender, txs in self.senders.items():
+            for nonce, tx in txs.items():
+                kind = 'pending' if nonce < self.pending_end[sender] else 'queued'
+                content[kind].setdefault(sender, dict())[nonce] = tx
+        return content
+
+    def __repr__(self):
+        return '<TxPool pending=%d queued=%d bytes=%d>' % (
+            self.num_pending, len(self.txs) - self.num_pending, self.size)
+
+
+class PendingSelection(object):
+
+    """
+    The pending transactions of a :class:`TxPool` in the order for a new block: by gas price
+    (forced ones first), but each sender's in nonce order. Implements the interface of
+    :class:`ethereum.transaction_queue.TransactionQueue` used by block building.
+
+    The pool must not be modified while the selection is in use.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.heap = []  # next pending tx of each sender
+        self.remaining = pool.num_pending
+        for sender in pool.senders:
+            if pool.nonces[sender] < pool.pending_end[sender]:
+                self._push(sender, pool.nonces[sender])
+
+    def __len__(self):
+        return self.remaining
+
+    @property
+    def txs(self):
+        "the pending transactions, as the `txs` of a TransactionQueue (logged by block building)"
+        return self.pool.pending()
+
+    def _push(self, sender, nonce):
+        tx = self.pool.senders[sender][nonce]
+        prio = PRIO_INFINITY if tx.hash in self.pool.forced else -tx.gasprice
+        heapq.heappush(self.heap, (prio, self.pool.info[tx.hash][2], sender, nonce))
+
+    def pop_transaction(self, max_gas=9999999999, max_seek_depth=16, min_gasprice=0):
+        while self.heap:
+            prio, _, sender, nonce = self.heap[0]
+            tx = self.pool.senders[sender][nonce]
+            if tx.gasprice < min_gasprice and prio != PRIO_INFINITY:
+                return None
+            heapq.heappop(self.heap)
+            if tx.startgas > max_gas:
+                # the sender's later txs depend on this one
+                self.remaining -= self.pool.pending_end[sender] - nonce
+                continue
+            self.remaining -= 1
+            if nonce + 1 < self.pool.pending_end[sender]:
+                self._push(sender, nonce + 1)
+            return tx
+        return None
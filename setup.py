@@ -56,6 +56,7 @@ setup(
     url='https://github.com/ethereum/pyethapp',
     packages=[
         'pyethapp',
+        'pyethapp.bench',
     ],
     package_data={
         'pyethapp': ['genesisdata/*.json']